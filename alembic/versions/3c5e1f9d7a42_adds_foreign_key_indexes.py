@@ -0,0 +1,35 @@
+"""adds indexes of likes.post_id and posts.user_id
+
+Revision ID: 3c5e1f9d7a42
+Revises: a734389e3878
+Create Date: 2026-10-18 15:21:37.604118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e1f9d7a42'
+down_revision = 'a734389e3878'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY does not block writes while building, but can not run in a transaction
+    with op.get_context().autocommit_block():
+        # likes by post (the _user_post constraint starts with user_id),
+        # e.g. ON DELETE CASCADE of posts
+        op.create_index('ix_likes_post_id', 'likes', ['post_id'],
+                        postgresql_concurrently=True)
+        # posts by author, e.g. ON DELETE CASCADE of users
+        op.create_index('ix_posts_user_id', 'posts', ['user_id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_user_id', table_name='posts',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_likes_post_id', table_name='likes',
+                      postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+"""adds likes_count column to posts table
+
+Revision ID: 638af0bc19f5
+Revises: f9bf9b98bbc5
+Create Date: 2026-10-18 09:12:40.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '638af0bc19f5'
+down_revision = 'f9bf9b98bbc5'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('likes_count', sa.Integer(),
+                  server_default='0', nullable=False))
+    # the column is committed first, then backfilled by ranges of post ids in a transaction
+    # per range, so no lock is held on all of posts until the end of the migration.
+    # Likes written meanwhile are counted by python -m app.reconcile
+    with op.get_context().autocommit_block():
+        engine = op.get_bind().engine
+        with engine.connect() as conn:
+            max_id = conn.execute(sa.text('SELECT coalesce(max(id), 0) FROM posts')).scalar()
+        for start in range(0, max_id, BATCH_SIZE):
+            with engine.begin() as conn:
+                conn.execute(sa.text(
+                    'UPDATE posts SET likes_count = counts.likes '
+                    'FROM (SELECT post_id, count(*) AS likes FROM likes '
+                    'WHERE post_id > :start AND post_id <= :end GROUP BY post_id) AS counts '
+                    'WHERE posts.id = counts.post_id'), {'start': start, 'end': start + BATCH_SIZE})
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'likes_count')
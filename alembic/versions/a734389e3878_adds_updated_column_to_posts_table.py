@@ -0,0 +1,26 @@
+"""adds updated column to posts table
+
+Revision ID: a734389e3878
+Revises: b0c119d52881
+Create Date: 2026-10-18 11:03:52.271904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a734389e3878'
+down_revision = 'b0c119d52881'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('updated', sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text('now()'), nullable=False))
+    op.execute('UPDATE posts SET updated = created')
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'updated')
@@ -0,0 +1,35 @@
+"""adds search indexes to posts table
+
+Revision ID: b0c119d52881
+Revises: e46c1158c84c
+Create Date: 2026-10-18 10:21:33.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b0c119d52881'
+down_revision = 'e46c1158c84c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # substring (ILIKE '%...%') search of titles
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_posts_title_trgm', 'posts', ['title'], postgresql_using='gin',
+                    postgresql_ops={'title': 'gin_trgm_ops'})
+    # full-text search of titles and content
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', content), 'B')", persisted=True)))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_search_vector', table_name='posts')
+    op.drop_column('posts', 'search_vector')
+    op.drop_index('ix_posts_title_trgm', table_name='posts')
@@ -0,0 +1,24 @@
+"""adds (created, id) index to posts table
+
+Revision ID: e46c1158c84c
+Revises: 638af0bc19f5
+Create Date: 2026-10-18 09:47:05.540917
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e46c1158c84c'
+down_revision = '638af0bc19f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # backs the keyset pagination of GET /posts
+    op.create_index('ix_posts_created_id', 'posts', ['created', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_created_id', table_name='posts')
@@ -0,0 +1,140 @@
+""" Admission control: concurrency budgets per group of routes with bounded wait queues
+
+Requests of a group beyond its concurrency wait in its queue. A request is shed
+(503 with Retry-After) when the queue is full, when the expected wait already exceeds
+the queue timeout of the group, or when the timeout passes. Separate budgets keep a
+spike of reads from taking logins and writes down with it
+"""
+import asyncio
+import math
+from collections import deque
+from typing import Optional
+
+from . import metrics
+from .config import settings
+
+AUTH = "auth"
+READ = "read"
+WRITE = "write"
+
+# never queued nor shed: monitoring must work under overload
+EXEMPT_PATHS = ("/metrics",)
+
+# weight of the latest request in the moving average of the service time
+EWMA_WEIGHT = 0.2
+
+
+class AdmissionGate:
+    """ Up to `concurrency` requests at once, up to `queue_size` more waiting at most
+    `timeout` seconds
+    """
+
+    def __init__(self, concurrency: int, queue_size: int, timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.shed = 0
+        self.service_seconds = 0.0  # moving average, estimates the wait in the queue
+        self._waiting = deque()
+
+    @property
+    def queued(self) -> int:
+        """ Requests waiting for a slot
+        """
+        return len(self._waiting)
+
+    def expected_wait(self) -> float:
+        """ Seconds a request queued now would likely wait
+        """
+        if self.concurrency <= 0:
+            return math.inf
+        return self.service_seconds * (self.queued + 1) / self.concurrency
+
+    async def acquire(self) -> bool:
+        """ Takes a slot, waiting in the queue if needed. False - the request is shed
+        """
+        if self.active < self.concurrency and not self._waiting:
+            self.active += 1
+            return True
+        if self.queued >= self.queue_size or self.expected_wait() > self.timeout:
+            self.shed += 1
+            return False
+        slot = asyncio.get_running_loop().create_future()
+        self._waiting.append(slot)
+        try:
+            await asyncio.wait([slot], timeout=self.timeout)
+        except BaseException:
+            # the client went away, pass on a slot handed over in the meantime
+            self._leave(slot)
+            raise
+        if slot.done():
+            return True
+        self._leave(slot)
+        self.shed += 1
+        return False
+
+    def release(self, seconds: float):
+        """ Frees a slot taken for `seconds`, hands it over to the longest waiting request
+        """
+        self.service_seconds += EWMA_WEIGHT * (seconds - self.service_seconds)
+        self._hand_over()
+
+    def _hand_over(self):
+        while self._waiting:
+            slot = self._waiting.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.active -= 1
+
+    def _leave(self, slot: asyncio.Future):
+        # the slot was not used, the service time is unchanged
+        if slot.done() and not slot.cancelled():
+            self._hand_over()
+            return
+        slot.cancel()
+        self._waiting.remove(slot)
+
+
+def _gates() -> dict:
+    return {group: AdmissionGate(settings.ADMISSION_CONCURRENCY[group],
+                                 settings.ADMISSION_QUEUE_SIZE[group],
+                                 settings.ADMISSION_QUEUE_TIMEOUT[group])
+            for group in (AUTH, READ, WRITE)}
+
+
+gates = _gates()
+
+
+def route_group(method: str, path: str) -> Optional[str]:
+    """ Budget of a request, None - exempt
+    """
+    path = path.rstrip("/")
+    if path in EXEMPT_PATHS:
+        return None
+    if path == "/login" or (method == "POST" and path == "/users"):
+        return AUTH
+    return READ if method in ("GET", "HEAD", "OPTIONS") else WRITE
+
+
+def retry_after(gate: AdmissionGate) -> int:
+    """ Seconds a shed client should wait before retrying
+    """
+    return max(1, math.ceil(min(gate.expected_wait(), gate.timeout)))
+
+
+def _collect_admission_metrics():
+    """ Slots in use and queue depths, read on every scrape
+    """
+    active = metrics.Gauge("admission_active", "Requests holding a slot", ("group",))
+    queued = metrics.Gauge("admission_queue_depth", "Requests waiting for a slot", ("group",))
+    shed = metrics.Counter("admission_shed_total", "Requests rejected with 503", ("group",))
+    for group, gate in gates.items():
+        active.labels(group).set(gate.active)
+        queued.labels(group).set(gate.queued)
+        shed.labels(group).set(gate.shed)
+    return [active, queued, shed]
+
+
+metrics.COLLECTORS.append(_collect_admission_metrics)
@@ -0,0 +1,69 @@
+""" In-process caches
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TTLCache:
+    """ Bounded LRU cache with a time to live per entry
+
+    Counts hits and misses so the size can be tuned. maxsize=0 disables the cache
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        # invalidation may come from threadpool workers
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Returns a live value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """ Stores a value for ttl seconds (the cache default if not provided),
+        evicts the least recently used
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """ Drops a key if present
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Drops all keys
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """ Returns usage counters
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data), "maxsize": self.maxsize}
@@ -0,0 +1,94 @@
+""" Response compression: content negotiation, compressors and the cache of compressed bodies
+"""
+import gzip
+import math
+import zlib
+from typing import Optional
+
+from .cache import TTLCache
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip is offered without it
+    brotli = None
+
+# media types worth compressing, matched as prefixes
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# a good ratio for JSON at a few ms per 100 KB
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# compressed bodies of responses with an ETag, keyed by (path, ETag, encoding):
+# the same ETag is always the same body, entries never go stale
+compressed_cache = TTLCache(settings.COMPRESSION_CACHE_SIZE, math.inf)
+
+
+def supported_encodings() -> tuple:
+    """ Content codings in the order of preference
+    """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """ Picks the preferred supported coding accepted with the highest q-value,
+    None - no compression
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in supported_encodings():
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """ Compresses a whole body
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """ Compresses a streamed body, every chunk is flushed so the client gets it at once
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """ Compressed bytes of a chunk
+        """
+        if self.encoding == "br":
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """ The end of the compressed stream
+        """
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def cache_stats() -> dict:
+    """ Returns hit/miss counters of the compressed bodies cache
+    """
+    return compressed_cache.stats()
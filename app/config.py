@@ -1,5 +1,7 @@
 """ Setting and type checking of env variables
 """
+from typing import Dict, List, Literal
+
 from pydantic import BaseSettings
 
 
@@ -8,11 +10,95 @@ class Settings(BaseSettings):
     """
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     ALGORITHM: str
+    # admission control per group of routes (auth - login and sign up, read, write):
+    # requests running at once, waiting at most, seconds of waiting before a 503
+    ADMISSION_CONCURRENCY: Dict[str, int] = {"auth": 8, "read": 64, "write": 32}
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_QUEUE_SIZE: Dict[str, int] = {"auth": 32, "read": 256, "write": 128}
+    ADMISSION_QUEUE_TIMEOUT: Dict[str, float] = {"auth": 5, "read": 1, "write": 2}
+    # max number of items of POST /posts/batch and POST /like/batch
+    BATCH_MAX_SIZE: int = 500
+    # cost of new password hashes, existing ones are rehashed on login
+    BCRYPT_ROUNDS: int = 12
+    # True - asyncpg engine + AsyncSession, False - psycopg2 engine + Session
+    DB_ASYNC: bool = True
+    # compressed bodies of responses with an ETag kept for reuse
+    COMPRESSION_CACHE_SIZE: int = 1000
+    # responses smaller than this are sent uncompressed (bytes)
+    COMPRESSION_MIN_SIZE: int = 1024
+    # compiled SQL statements cached per engine, 0 - compile every statement
+    DB_COMPILED_CACHE_SIZE: int = 500
+    # transaction pooling (PgBouncer) safe connections: no server-side prepared statements
+    DB_PGBOUNCER: bool = False
+    # connection pool per engine and worker process: DB_POOL_SIZE persistent connections
+    # plus up to DB_POOL_MAX_OVERFLOW temporary ones, DB_POOL_TIMEOUT seconds of waiting
+    # for a free connection before an error, connections older than DB_POOL_RECYCLE
+    # seconds are replaced (-1 - never), DB_POOL_PRE_PING tests connections on checkout.
+    # DB_POOL_DISABLED opens a connection per session (NullPool), e.g. behind PgBouncer
+    DB_POOL_DISABLED: bool = False
+    DB_POOL_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = False
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_SIZE: int = 5
+    DB_POOL_TIMEOUT: float = 30
+    # connections opened per pool at startup (at most DB_POOL_SIZE), 0 - connect on demand
+    DB_POOL_WARMUP: int = 2
+    # server-side prepared statements kept per asyncpg connection (the async mode),
+    # 0 - statements are parsed on every execution. psycopg2 (the sync mode) does not prepare
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+    # reads of a client go to the primary for this long after it wrote, 0 - never
+    DB_PRIMARY_PIN_SECONDS: float = 0
+    # adds X-DB-Queries (number of SQL statements of the request) to responses
+    DB_QUERY_COUNT_HEADER: bool = False
+    # read replicas of GET routes as a JSON list of postgresql:// URLs, empty - the primary only
+    DB_REPLICA_URLS: List[str] = []
+    # an unavailable replica is skipped for this long
+    DB_REPLICA_RETRY_SECONDS: float = 30
+    # rows fetched per round trip by the NDJSON exports
+    EXPORT_BATCH_SIZE: int = 1000
+    # write-behind buffer of likes (app/like_buffer.py), flushed when it holds
+    # LIKE_BUFFER_MAX_SIZE likes or every LIKE_BUFFER_FLUSH_SECONDS. Beyond LIKE_BUFFER_MAX_PENDING
+    # likes waiting for a flush (e.g. while flushes fail) new ones are rejected with 503
+    LIKE_BUFFER_FLUSH_SECONDS: float = 0.5
+    LIKE_BUFFER_MAX_PENDING: int = 100000
+    LIKE_BUFFER_MAX_SIZE: int = 1000
+    LIKES_WRITE_BEHIND: bool = False
     POSTGRES_DB: str
     POSTGRES_HOST: str
     POSTGRES_PASSWORD: str
     POSTGRES_USER: str
+    # cache of GET /posts/{post_id} and the first pages of GET /posts/ (app/post_cache.py):
+    # "" - off, "memory" - per worker, "redis" - shared by the workers through POST_CACHE_REDIS_URL.
+    # Entries are fresh for POST_CACHE_TTL_SECONDS, then served for POST_CACHE_STALE_SECONDS more
+    # while they are refreshed in the background. Missing posts are remembered for
+    # POST_CACHE_NEGATIVE_TTL_SECONDS (0 - not cached). POST_CACHE_NOTIFY sends invalidations
+    # to the other workers through Postgres LISTEN/NOTIFY
+    POST_CACHE_BACKEND: Literal["", "memory", "redis"] = ""
+    POST_CACHE_NEGATIVE_TTL_SECONDS: float = 0
+    POST_CACHE_NOTIFY: bool = True
+    POST_CACHE_REDIS_TIMEOUT: float = 0.5
+    POST_CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    POST_CACHE_SIZE: int = 10000
+    POST_CACHE_STALE_SECONDS: float = 0
+    POST_CACHE_TTL_SECONDS: float = 30
+    # Prometheus metrics of requests, SQL and pools at GET /metrics
+    METRICS_ENABLED: bool = True
+    # profiling of requests sent with X-Profile: <PROFILING_TOKEN>, reports go to PROFILING_DIR
+    PROFILING_DIR: str = "profiles"
+    PROFILING_ENABLED: bool = False
+    PROFILING_TOKEN: str = ""
+    # password hashing pool, 0 - one worker per core.
+    # Jobs beyond workers + queue size are rejected with 503
+    PWD_HASH_QUEUE_SIZE: int = 64
+    PWD_HASH_WORKERS: int = 0
     SECRET_KEY: str
+    # SQL statements slower than this are logged and counted
+    SLOW_QUERY_SECONDS: float = 0.5
+    # decoded JWTs, entries live until the token expires
+    TOKEN_CACHE_SIZE: int = 10000
+    # authenticated users, 0 disables the cache
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 300
 
     class Config:
         """Env variables source
@@ -0,0 +1,177 @@
+""" Write-behind buffer of likes
+
+Likes and dislikes are accepted into memory, de-duplicated per (user_id, post_id)
+and written in batched transactions, so a viral post costs one counter update per
+flush instead of one transaction per like. Enabled by settings.LIKES_WRITE_BEHIND.
+
+The buffer is per process: a user reads their own writes from the worker that took them,
+a batch being flushed included
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, update, select, tuple_, column, values, Integer
+from sqlalchemy.dialects.postgresql import insert
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+LIKE = True
+DISLIKE = False
+
+# attempts of the final flush at stop, the delay between them doubles
+STOP_FLUSH_ATTEMPTS = 3
+STOP_RETRY_SECONDS = 0.5
+
+
+class LikeBufferFull(Exception):
+    """ Raised when a LikeBuffer holds max_pending likes, e.g. while flushes keep failing
+    """
+
+
+class LikeBuffer:
+    """ Pending like (True) / dislike (False) per (user_id, post_id), flushed on size or time
+    """
+
+    def __init__(self, max_size: int, flush_interval: float, session_scope, on_flush=None,
+                 max_pending: int = 100000):
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        # async context manager yielding a session, see app.database.session_scope
+        self.session_scope = session_scope
+        # awaited with the ids of the posts whose likes changed, after the commit
+        self.on_flush = on_flush
+        self.pending: Dict[Tuple[int, int], bool] = {}
+        # the batch of the flush in progress, readable until it is committed
+        self.flushing: Dict[Tuple[int, int], bool] = {}
+        self._stopping = False
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def state(self, user_id: int, post_id: int) -> Optional[bool]:
+        """ Pending state of a like, None if there is nothing pending
+        """
+        key = (user_id, post_id)
+        liked = self.pending.get(key)
+        return self.flushing.get(key) if liked is None else liked
+
+    def put(self, user_id: int, post_id: int, liked: bool):
+        """ Records a like or a dislike, the latest one per user and post wins.
+        Raises LikeBufferFull instead of holding more than max_pending likes
+        """
+        key = (user_id, post_id)
+        if key not in self.pending and len(self.pending) + len(self.flushing) >= self.max_pending:
+            raise LikeBufferFull()
+        self.pending[key] = liked
+        if len(self.pending) >= self.max_size:
+            self._flush_requested.set()
+
+    def cancel(self, user_id: int, post_id: int):
+        """ Reverts a pending like or dislike (the new one undoes it)
+        """
+        key = (user_id, post_id)
+        if key in self.pending:
+            del self.pending[key]
+        elif key in self.flushing:
+            # already being written, the revert is written by the next flush
+            self.pending[key] = not self.flushing[key]
+
+    async def start(self):
+        """ Starts flushing in the background
+        """
+        self._stopping = False
+        self._flush_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Stops the background flushing and drains what is pending, retrying a failed
+        drain STOP_FLUSH_ATTEMPTS times. The likes still pending then are logged and dropped
+        """
+        if self._task is not None:
+            # a flush in progress is never cancelled
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        delay = STOP_RETRY_SECONDS
+        for attempt in range(1, STOP_FLUSH_ATTEMPTS + 1):
+            try:
+                await self.flush()
+                return
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Draining %d pending likes failed (attempt %d of %d)",
+                                 len(self.pending), attempt, STOP_FLUSH_ATTEMPTS)
+            if attempt < STOP_FLUSH_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay *= 2
+        dropped, self.pending = self.pending, {}
+        logger.error("Dropping %d likes that were not written, (user_id, post_id) -> liked: %s",
+                     len(dropped), dropped)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Flushing %d pending likes failed", len(self.pending))
+
+    async def flush(self):
+        """ Writes the pending likes in one transaction, puts them back if it fails
+        """
+        # one flush at a time, the next one picks up what was put meanwhile
+        if not self.pending or self.flushing:
+            return
+        batch = self.flushing = self.pending
+        self.pending = {}
+        try:
+            async with self.session_scope() as db:
+                post_ids = await _write(db, batch)
+        except Exception:
+            # newer changes of the same likes win over the failed ones
+            self.pending = {**batch, **self.pending}
+            raise
+        finally:
+            self.flushing = {}
+        if post_ids and self.on_flush is not None:
+            await self.on_flush(*post_ids)
+
+
+async def _write(db, batch: Dict[Tuple[int, int], bool]):
+    """ Applies a batch: inserts likes of existing posts, deletes dislikes, shifts counters
+    once per post. Returns the ids of the posts whose counters changed
+    """
+    likes = [key for key, liked in batch.items() if liked]
+    dislikes = [key for key, liked in batch.items() if not liked]
+    inserted, deleted = [], []
+    if likes:
+        rows = values(column("user_id", Integer), column("post_id", Integer),
+                      name="batch").data(likes)
+        # posts deleted in the meantime are skipped rather than failing the whole batch
+        inserted = (await db.execute(insert(models.Like).from_select(
+            ["user_id", "post_id"], select(rows.c.user_id, rows.c.post_id).join(
+                models.Post, models.Post.id == rows.c.post_id)).on_conflict_do_nothing(
+            constraint="_user_post").returning(models.Like.post_id))).scalars().all()
+    if dislikes:
+        deleted = (await db.execute(delete(models.Like).filter(
+            tuple_(models.Like.user_id, models.Like.post_id).in_(dislikes))
+            .returning(models.Like.post_id)
+            .execution_options(synchronize_session=False))).scalars().all()
+    deltas = Counter(inserted)
+    deltas.subtract(deleted)
+    deltas = [(post_id, delta) for post_id, delta in deltas.items() if delta]
+    if deltas:
+        shifts = values(column("id", Integer), column("delta", Integer), name="shifts").data(deltas)
+        await db.execute(update(models.Post).filter(models.Post.id == shifts.c.id).values(
+            likes_count=models.Post.likes_count + shifts.c.delta).execution_options(
+            synchronize_session=False))
+    await db.commit()
+    return [post_id for post_id, _ in deltas]
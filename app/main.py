@@ -1,32 +1,127 @@
 """ Application entrypoint
+
+    uvicorn app.main:app  (or: uvicorn --factory app.main:create_app)
 """
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import posts, users, auth, likes
+from fastapi.responses import ORJSONResponse
+from jose import jwt
+from sqlalchemy.orm import configure_mappers
+from .routers import posts, users, auth, likes, stats, metrics
+from . import database, oauth2, utils
+from .post_cache import post_cache
+from .config import settings
+from .middleware import (QueryCountMiddleware, PrimaryPinMiddleware, MetricsMiddleware,
+                         ProfilingMiddleware, CompressionMiddleware, AdmissionMiddleware)
+
+logger = logging.getLogger(__name__)
 
 #  public API
 # TODO Update for security
 origins = ["*"]
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def warm_up():
+    """ Pays the one-off costs of the first requests before serving them: ORM mappers,
+    the bcrypt backend and a password hashing thread, the JWT codec and pooled DB connections
+    """
+    configure_mappers()
+    await utils.pwd_executor.run(utils.PWD_CONTEXT.handler().get_backend)
+    jwt.decode(oauth2.create_access_token({"user_id": 0}), settings.SECRET_KEY,
+               algorithms=[settings.ALGORITHM])
+    await database.warm_up_pools(settings.DB_POOL_WARMUP)
+
+
+# apps started by lifespan: the process-wide resources (like buffer, post cache invalidations,
+# DB pools, password hashing threads) are started with the first one and released with the last one
+_running_apps = set()
 
-app.include_router(posts.router)
-app.include_router(users.router)
-app.include_router(auth.router)
-app.include_router(likes.router)
+
+async def _start_shared():
+    if settings.LIKES_WRITE_BEHIND:
+        await likes.like_buffer.start()
+    if post_cache.enabled and settings.POST_CACHE_NOTIFY:
+        await post_cache.listen(database.DB_URL)
+
+
+async def _stop_shared():
+    await likes.like_buffer.stop()
+    await post_cache.close()
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+    for async_engine in database.async_replica_engines:
+        await async_engine.dispose()
+    database.engine.dispose()
+    for engine in database.replica_engines:
+        engine.dispose()
+    await utils.pwd_executor.shutdown()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """ Warms up, starts the background writers and the post cache invalidations with the first app.
+    The last app to shut down drains buffered writes, closes the post cache, pooled DB connections
+    and worker threads, so shutting down an app leaves the others of the process working
+    """
+    start = time.perf_counter()
+    await warm_up()
+    first = not _running_apps
+    _running_apps.add(app)
+    if first:
+        await _start_shared()
+    app.state.startup_seconds = time.perf_counter() - start
+    logger.info("Started in %.3fs", app.state.startup_seconds)
+    yield
+    _running_apps.discard(app)
+    if not _running_apps:
+        await _stop_shared()
 
 
-@app.get("/")
 def root():
     """  Returns a dummy output for the root
     """
     return {"message": "FastAPI + SQLAlchemy + PostgresSQL"}
+
+
+def create_app(dependency_overrides: Optional[dict] = None) -> FastAPI:
+    """ Builds an application instance, dependency_overrides are applied to it only
+    """
+    app = FastAPI(default_response_class=ORJSONResponse)
+    # FastAPI does not take a lifespan yet, its router does
+    app.router.lifespan_context = lifespan
+
+    # the last added middleware is the outermost one
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(QueryCountMiddleware)
+    app.add_middleware(PrimaryPinMiddleware)
+    # outermost: the 503 of shed requests carries the CORS headers too
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+
+    app.include_router(posts.router)
+    app.include_router(users.router)
+    app.include_router(auth.router)
+    app.include_router(likes.router)
+    app.include_router(stats.router)
+    app.include_router(metrics.router)
+    app.add_api_route("/", root, methods=["GET"])
+
+    app.dependency_overrides.update(dependency_overrides or {})
+    return app
+
+
+app = create_app()
@@ -0,0 +1,191 @@
+""" In-process metrics, exposed in the Prometheus text format by GET /metrics
+"""
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# media type of the Prometheus text exposition format, the response adds charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    """ Counts observed values per bucket, upper bounds are inclusive (Prometheus style)
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        # observations may come from threadpool workers
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """ Records a value
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self) -> dict:
+        """ Returns cumulative counts per upper bound, the total count and the sum
+        """
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": cumulative, "sum": total}
+
+
+class Value:
+    """ A counter or gauge sample
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        """ Adds amount
+        """
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        """ Subtracts amount
+        """
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        """ Replaces the value
+        """
+        self.value = value
+
+
+class Family:
+    """ Samples of one metric per combination of label values
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return Value()
+
+    def labels(self, *values: str):
+        """ Returns the sample of the label values, created on first use
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> List[str]:
+        """ Lines of the text exposition format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(_labels(self.labelnames, values), child))
+        return lines
+
+    def _render_child(self, labels: str, child) -> List[str]:
+        return [f"{self.name}{{{labels}}} {_number(child.value)}" if labels
+                else f"{self.name} {_number(child.value)}"]
+
+
+class Counter(Family):
+    """ Monotonic totals
+    """
+    kind = "counter"
+
+
+class Gauge(Family):
+    """ Current values
+    """
+    kind = "gauge"
+
+
+class HistogramFamily(Family):
+    """ Histograms with the same buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def _new_child(self):
+        return Histogram(self.buckets)
+
+    def _render_child(self, labels: str, child) -> List[str]:
+        snapshot = child.snapshot()
+        prefix = f"{labels}," if labels else ""
+        lines = [f'{self.name}_bucket{{{prefix}le="{_number(float(bound))}"}} {count}'
+                 for bound, count in snapshot["buckets"].items()]
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {_number(snapshot['sum'])}")
+        lines.append(f"{self.name}_count{suffix} {snapshot['count']}")
+        return lines
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# metrics rendered by GET /metrics, collectors are called on every scrape for current values
+FAMILIES: List[Family] = []
+COLLECTORS: List[Callable[[], List[Family]]] = []
+
+
+def register(family: Family) -> Family:
+    """ Adds a metric to the exposition, returns it
+    """
+    FAMILIES.append(family)
+    return family
+
+
+def render() -> str:
+    """ All the metrics in the text exposition format
+    """
+    families = list(FAMILIES)
+    for collect in COLLECTORS:
+        families.extend(collect())
+    return "\n".join(line for family in families for line in family.render()) + "\n"
+
+
+# seconds, from fast lookups to requests near the pool timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = register(HistogramFamily(
+    "http_request_duration_seconds", "Request latency per route and status",
+    ("method", "route", "status"), LATENCY_BUCKETS))
+REQUESTS_IN_FLIGHT = register(Gauge("http_requests_in_flight", "Requests being served"))
+QUERIES = register(Counter("db_queries_total", "SQL statements per route", ("route",)))
+QUERY_SECONDS = register(Counter(
+    "db_query_seconds_total", "Time spent in SQL statements per route", ("route",)))
+SLOW_QUERIES = register(Counter(
+    "db_slow_queries_total", "SQL statements slower than SLOW_QUERY_SECONDS per route", ("route",)))
+COMPILED_CACHE = register(Counter(
+    "db_compiled_cache_total",
+    "Compiled SQL cache lookups of executed statements (hit, miss, uncached)", ("result",)))
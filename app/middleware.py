@@ -0,0 +1,291 @@
+""" ASGI middlewares
+"""
+import asyncio
+import cProfile
+import hmac
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from . import admission, compression, database, metrics, profiling
+from .config import settings
+
+
+class QueryCountMiddleware:
+    """ Counts SQL statements per request, reports them in X-DB-Queries if enabled
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with database.count_queries() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start" and settings.DB_QUERY_COUNT_HEADER:
+                    MutableHeaders(scope=message).append("X-DB-Queries", str(counter.count))
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
+
+
+# methods that do not write
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class PrimaryPinMiddleware:
+    """ Pins a client (its Authorization header) to the primary DB for
+    settings.DB_PRIMARY_PIN_SECONDS after a successful write, so its reads do not see
+    replicas lagging behind its own writes
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_and_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400 \
+                    and settings.DB_PRIMARY_PIN_SECONDS > 0:
+                client = Headers(scope=scope).get("authorization")
+                if client is not None:
+                    database.read_router.pin(client, settings.DB_PRIMARY_PIN_SECONDS)
+            await send(message)
+
+        await self.app(scope, receive, send_and_pin)
+
+
+# route label of requests that matched no route, keeps the label values bounded
+UNMATCHED_ROUTE = "unmatched"
+# method label of requests with any other method, clients can send arbitrary ones
+OTHER_METHOD = "other"
+KNOWN_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"))
+
+
+class MetricsMiddleware:
+    """ Records latency per route and status, requests in flight and the SQL statements
+    of each route (from the counter of QueryCountMiddleware, which must wrap this one)
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = {}  # endpoint -> path template
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            path = next((route.path for route in scope["app"].routes
+                         if getattr(route, "endpoint", None) is endpoint), UNMATCHED_ROUTE)
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # if the app fails before responding
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.REQUESTS_IN_FLIGHT.labels().inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.REQUESTS_IN_FLIGHT.labels().dec()
+            route = self._route(scope)
+            method = scope["method"] if scope["method"] in KNOWN_METHODS else OTHER_METHOD
+            metrics.REQUEST_DURATION.labels(method, route, str(status)).observe(elapsed)
+            counter = database.current_query_counter()
+            if counter is not None and counter.count:
+                metrics.QUERIES.labels(route).inc(counter.count)
+                metrics.QUERY_SECONDS.labels(route).inc(counter.seconds)
+                if counter.slow:
+                    metrics.SLOW_QUERIES.labels(route).inc(counter.slow)
+
+
+class ProfilingMiddleware:
+    """ Profiles requests sent with the profiling header and token, see app.profiling.
+    Must be wrapped by QueryCountMiddleware to record the SQL statements
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # one profiler can be active per thread
+        self._lock = asyncio.Lock()
+
+    def _requested(self, scope) -> bool:
+        token = Headers(scope=scope).get(profiling.PROFILE_HEADER)
+        return token is not None and bool(settings.PROFILING_TOKEN) and hmac.compare_digest(
+            token.encode(), settings.PROFILING_TOKEN.encode())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.PROFILING_ENABLED or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        async with self._lock:
+            await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        counter = database.current_query_counter()
+        statements = []
+        if counter is not None:
+            counter.statements = statements
+        report_id = None
+        status = 500
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+
+        async def send_with_report_id(message):
+            nonlocal report_id, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # the report of the request so far, a streamed body is not profiled
+                profile.disable()
+                report_id = await run_in_threadpool(
+                    profiling.write_report, settings.PROFILING_DIR,
+                    f"{scope['method']} {scope['path']}", status, time.perf_counter() - start,
+                    profile, list(statements))
+                MutableHeaders(scope=message).append(profiling.PROFILE_ID_HEADER, report_id)
+            await send(message)
+
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_report_id)
+        finally:
+            profile.disable()
+            if counter is not None:
+                counter.statements = None
+
+
+class CompressionMiddleware:
+    """ Compresses responses with the best coding of Accept-Encoding (br, gzip).
+    Small bodies (settings.COMPRESSION_MIN_SIZE) are sent as they are, streamed
+    bodies are compressed chunk by chunk. Compressed bodies of responses with
+    an ETag are cached, so a hot post is compressed once
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = compression.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None  # held until the first body part tells if and how to compress
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is not None:
+                body = compressor.compress(body)
+                if not more_body:
+                    body += compressor.finish()
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(scope=start)
+            if not _compressible(start["status"], headers) or (
+                    not more_body and len(body) < settings.COMPRESSION_MIN_SIZE):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                # the same content in another coding, If-None-Match compares weakly
+                headers["ETag"] = f"W/{etag}"
+            if more_body:
+                del headers["Content-Length"]
+                compressor = compression.StreamCompressor(encoding)
+                body = compressor.compress(body)
+            else:
+                body = _compress_whole(scope["path"], etag, body, encoding)
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _compressible(status: int, headers: MutableHeaders) -> bool:
+    return status not in (204, 304) and "content-encoding" not in headers and \
+        headers.get("content-type", "").startswith(compression.COMPRESSIBLE_TYPES)
+
+
+def _compress_whole(path: str, etag, body: bytes, encoding: str) -> bytes:
+    if etag is None:
+        return compression.compress(body, encoding)
+    key = (path, etag, encoding)
+    compressed = compression.compressed_cache.get(key)
+    if compressed is None:
+        compressed = compression.compress(body, encoding)
+        compression.compressed_cache.set(key, compressed)
+    return compressed
+
+
+# body of the responses of shed requests
+SHED_BODY = b'{"detail":"Server is busy, retry later"}'
+
+
+class AdmissionMiddleware:
+    """ Admits requests within the budgets of their route group, sheds the rest with 503,
+    see app.admission
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        group = None
+        if scope["type"] == "http":
+            group = admission.route_group(scope["method"], scope["path"])
+        if group is None or not settings.ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+
+        gate = admission.gates[group]
+        if not await gate.acquire():
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(SHED_BODY)).encode()),
+                (b"retry-after", str(admission.retry_after(gate)).encode())]})
+            await send({"type": "http.response.body", "body": SHED_BODY})
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.perf_counter() - start)
@@ -1,8 +1,10 @@
 """Models for the DB
 """
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import (Column, Integer, String, Boolean, Text, ForeignKey, UniqueConstraint, Index,
+                        Computed)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql.expression import text
 
 from .database import Base
@@ -18,12 +20,30 @@ class Post(Base):
     is_published = Column(Boolean, server_default="TRUE", nullable=False)
     created = Column(TIMESTAMP(timezone=True), nullable=False,
                      server_default=text("now()"))
+    # version of the post content, part of its ETag. Set by update_post
+    # (not onupdate: likes_count changes must not touch it)
+    updated = Column(TIMESTAMP(timezone=True), nullable=False,
+                     server_default=text("now()"))
     # Foreign key
     # CASCADE option - delete all related posts if user gets deleted
     user_id = Column(Integer, ForeignKey(
         "users.id", ondelete="CASCADE"), nullable=False)
-    # auto retrieves user
-    user = relationship("User")
+    # denormalized count of likes, kept in sync by the likes routes
+    likes_count = Column(Integer, server_default="0", nullable=False)
+    # full-text search document maintained by Postgres, title matches rank higher.
+    # deferred - never loaded with the post itself
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', content), 'B')", persisted=True)))
+    # authors come from the users join of the listing queries (_listing_select, POST_BY_ID)
+    # or from current_user for writes. raise_on_sql only guards against N+1 queries
+    user = relationship("User", lazy="raise_on_sql")
+    # keyset pagination order, full-text search, posts of a user.
+    # The pg_trgm index for substring search of titles (ix_posts_title_trgm) is
+    # created by the migrations only: it requires the pg_trgm extension
+    __table_args__ = (Index("ix_posts_created_id", "created", "id"),
+                      Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+                      Index("ix_posts_user_id", "user_id"))
 
 
 class User(Base):
@@ -48,7 +68,8 @@ class Like(Base):
         "users.id", ondelete="CASCADE"), nullable=False)
     post_id = Column(Integer, ForeignKey(
         "posts.id", ondelete="CASCADE"), nullable=False)
-    # adds constraint of uniqueness of the pair post_id and user_id
+    # adds constraint of uniqueness of the pair post_id and user_id,
+    # its index starts with user_id, likes of a post need their own index
     # __table_args__ must be a tuple
     __table_args__ = (UniqueConstraint(
-        "user_id", "post_id", name="_user_post"),)
+        "user_id", "post_id", name="_user_post"), Index("ix_likes_post_id", "post_id"))
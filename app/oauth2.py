@@ -1,22 +1,35 @@
 """ Authentication module
 """
 
+import time
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 from . import schemas, models
+from .cache import TTLCache
 from .database import get_db
 from .config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# raw token -> schemas.TokenPayload
+token_cache = TTLCache(settings.TOKEN_CACHE_SIZE,
+                       settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# user id -> schemas.UserResponse (a snapshot, never an ORM object shared between sessions)
+user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
 
 MESSAGE_403 = "403 Failed authorization"
 MESSAGE_404 = "User not found"
 
+# prebuilt, parameterized by :user_id
+USER_BY_ID = select(models.User).filter(models.User.id == bindparam("user_id"))
+
 
 def create_access_token(payload: dict) -> str:
     """Creates a JWT token
@@ -29,22 +42,28 @@ def create_access_token(payload: dict) -> str:
     return encoder_jwt
 
 
-def verify_access_token(token: str, credentials_exception) -> bool:
+def verify_access_token(token: str, credentials_exception) -> schemas.TokenPayload:
     """Verifies a JWT token
     """
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[
                              settings.ALGORITHM])
         user_id = payload.get("user_id")
-        if not user_id:
+        # every issued token expires, one without exp was not issued here
+        if not user_id or payload.get("exp") is None:
             raise credentials_exception
         token_data = schemas.TokenPayload(id=user_id)
     except JWTError as e:
         raise credentials_exception from e
+    # a cached token must not outlive its expiration
+    token_cache.set(token, token_data, ttl=payload["exp"] - time.time())
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     """ Gets current user based on the token
     """
     credentials_exception = HTTPException(
@@ -53,9 +72,48 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         headers={"WWW-Authenticate": "Bearer"})
 
     token_data = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(
-        models.User.id == token_data.id).first()
+    user = user_cache.get(token_data.id)
+    if user is not None:
+        return user
+    user = (await db.execute(USER_BY_ID, {"user_id": token_data.id})).scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
+    user = schemas.UserResponse.from_orm(user)
+    user_cache.set(user.id, user)
     return user
+
+
+def invalidate_user(user_id: int):
+    """ Drops a user from the authentication cache, call it when a user is changed or deleted
+    """
+    user_cache.invalidate(user_id)
+
+
+def cache_stats() -> dict:
+    """ Returns hit/miss counters of the authentication caches
+    """
+    return {"users": user_cache.stats(), "tokens": token_cache.stats()}
+
+
+# ORM changes of users are invalidated on flush (the current process sees them at once)
+# and again on commit (drops rows re-cached by concurrent requests before the commit)
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(_mapper, _connection, target):
+    invalidate_user(target.id)
+    object_session(target).info.setdefault("changed_user_ids", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_changed_users(orm_execute_state):
+    # UPDATE/DELETE statements do not tell which rows they change
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is models.User.__mapper__:
+        user_cache.clear()
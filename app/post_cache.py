@@ -0,0 +1,477 @@
+""" Shared cache of post reads
+
+GET /posts/{post_id} and the first pages of GET /posts/ are kept rendered (ETag and
+JSON body) in a backend: MemoryBackend per worker or RedisBackend shared by all workers.
+Writes of posts and likes drop the entries of the changed posts and all listings after
+their commit, and fan the invalidation out to the other workers over Postgres LISTEN/NOTIFY.
+
+Listings are keyed by a generation token replaced on every invalidation, so they can be
+dropped at once without knowing which pages are cached. Misses are loaded from the primary,
+a lagging replica would store entries older than the writes that dropped them. Entries
+loaded while a write commits may outlive it until they expire
+"""
+import asyncio
+import logging
+import math
+import secrets
+import time
+from typing import Awaitable, Callable, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import asyncpg
+
+from . import schemas
+from .cache import TTLCache
+from .config import settings
+from .database import read_router
+
+logger = logging.getLogger(__name__)
+
+# LISTEN/NOTIFY channel of the invalidations, the payload is a comma separated list of post ids
+CHANNEL = "post_cache"
+# delays between the attempts to listen again after the connection was lost, doubled up to the max
+RECONNECT_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30
+GENERATION_KEY = "posts:generation"
+
+
+class RedisError(Exception):
+    """ Error reply of a Redis server
+    """
+
+
+# backend failures are logged and read as misses, the DB stays the source of truth
+BACKEND_ERRORS = (OSError, EOFError, asyncio.TimeoutError, RedisError)
+
+
+class Entry(NamedTuple):
+    """ A rendered response
+    """
+    etag: str
+    body: bytes
+
+
+class MemoryBackend:
+    """ Entries of this worker only, the other workers learn about invalidations through NOTIFY
+    """
+    shared = False
+
+    def __init__(self, maxsize: int):
+        self.entries = TTLCache(maxsize, math.inf)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """ Returns a live value or None
+        """
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float = math.inf):
+        """ Stores a value for ttl seconds
+        """
+        self.entries.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        """ Drops keys if present
+        """
+        for key in keys:
+            self.entries.invalidate(key)
+
+    async def clear(self):
+        """ Drops all keys
+        """
+        self.entries.clear()
+
+    async def close(self):
+        """ Nothing to release
+        """
+
+
+class RedisBackend:
+    """ Entries shared by all workers in a server speaking the Redis protocol (RESP)
+
+    Commands of a worker go one at a time over a single connection, which is
+    reopened on the next command after a failure
+    """
+    shared = True
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._streams = None
+        self._lock = asyncio.Lock()
+
+    async def command(self, *args):
+        """ Sends a command and returns its reply
+        """
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self._command(args), self.timeout)
+            except BaseException:
+                # a reply may still be on its way, the connection is out of sync
+                await self._disconnect()
+                raise
+
+    async def _command(self, args):
+        if self._streams is None:
+            streams = await asyncio.open_connection(self.host, self.port)
+            if self.password:
+                await _call(*streams, ("AUTH", self.password))
+            if self.db:
+                await _call(*streams, ("SELECT", self.db))
+            self._streams = streams
+        return await _call(*self._streams, args)
+
+    async def _disconnect(self):
+        if self._streams is not None:
+            writer = self._streams[1]
+            self._streams = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """ Returns a live value or None
+        """
+        return await self.command("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float = math.inf):
+        """ Stores a value for ttl seconds
+        """
+        if ttl == math.inf:
+            await self.command("SET", key, value)
+        else:
+            await self.command("SET", key, value, "PX", max(int(ttl * 1000), 1))
+
+    async def delete(self, *keys: str):
+        """ Drops keys if present
+        """
+        await self.command("DEL", *keys)
+
+    async def close(self):
+        """ Closes the connection
+        """
+        async with self._lock:
+            await self._disconnect()
+
+
+async def _call(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args):
+    """ Writes a command as an array of bulk strings, reads its reply
+    """
+    chunks = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        value = arg if isinstance(arg, bytes) else str(arg).encode()
+        chunks.append(b"$%d\r\n%s\r\n" % (len(value), value))
+    writer.write(b"".join(chunks))
+    await writer.drain()
+    return await _read_reply(reader)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = (await reader.readuntil(b"\r\n"))[:-2]
+    kind, rest = line[:1], line[1:]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise RedisError(f"Unexpected reply {line[:32]!r}")
+
+
+class Notifier:
+    """ Sends and receives the invalidations of the workers over Postgres LISTEN/NOTIFY
+
+    A lost connection is reopened in the background, on_reconnect is called once it
+    listens again since the invalidations sent in between were missed
+    """
+
+    def __init__(self, dsn: str, on_message: Callable[[str], None],
+                 on_reconnect: Optional[Callable[[], Awaitable]] = None):
+        self.dsn = dsn
+        self.on_message = on_message
+        self.on_reconnect = on_reconnect
+        self._connection = None
+        self._reconnecting = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        """ Connects and listens
+        """
+        self._connection = await self._connect()
+
+    async def _connect(self):
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(CHANNEL, self._received)
+        except BaseException:
+            await connection.close()
+            raise
+        connection.add_termination_listener(self._terminated)
+        return connection
+
+    def _terminated(self, connection):
+        # stop() forgets the connection before closing it
+        if connection is not self._connection:
+            return
+        logger.warning("Lost the connection listening to post cache invalidations, reconnecting")
+        self._connection = None
+        self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = RECONNECT_SECONDS
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                self._connection = await self._connect()
+            except (asyncpg.PostgresError, OSError):
+                logger.warning("Listening to post cache invalidations again failed, "
+                               "retrying in %ss", delay, exc_info=True)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+                continue
+            logger.info("Listening to post cache invalidations again")
+            self._reconnecting = None
+            if self.on_reconnect is not None:
+                await self.on_reconnect()
+            return
+
+    def _received(self, connection, pid, _channel, payload):
+        # the sender has already applied its own invalidations
+        if pid != connection.get_server_pid():
+            self.on_message(payload)
+
+    async def publish(self, payload: str):
+        """ Notifies the other workers, a failure is logged: their entries expire eventually
+        """
+        if self._connection is None:
+            return
+        try:
+            async with self._lock:
+                await self._connection.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+            logger.warning("Publishing a post cache invalidation failed", exc_info=True)
+
+    async def stop(self):
+        """ Stops listening and disconnects
+        """
+        if self._reconnecting is not None:
+            reconnecting, self._reconnecting = self._reconnecting, None
+            reconnecting.cancel()
+            try:
+                await reconnecting
+            except asyncio.CancelledError:
+                pass
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await connection.close()
+
+
+class PostCache:
+    """ Rendered post reads in a backend, backend=None disables the cache
+
+    Entries are fresh for ttl seconds, then served for stale more seconds while one
+    background refresh per key reloads them. Missing posts are remembered for negative_ttl
+    seconds (0 - not cached). Misses read from a replica and refreshes run in sessions of
+    session_scope, which must be on the primary
+    """
+
+    def __init__(self, backend, ttl: float, stale: float, negative_ttl: float, session_scope):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self.negative_ttl = negative_ttl
+        self.session_scope = session_scope
+        self.notifier: Optional[Notifier] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._refreshing = {}  # key -> task
+        self._dropping = set()  # tasks of received invalidations
+
+    @property
+    def enabled(self) -> bool:
+        """ True if reads are cached
+        """
+        return self.backend is not None
+
+    async def post(self, post_id: int, view: schemas.PostView, db,
+                   load: Callable[..., Awaitable[Optional[Entry]]]) -> Optional[Entry]:
+        """ A post in a view, load(db) renders it on a miss (None - missing)
+        """
+        return await self._fetch(_post_key(post_id, view), db, load)
+
+    async def listing(self, name: str, db, load: Callable[..., Awaitable[Entry]]) -> Entry:
+        """ A page of posts named by its options, load(db) renders it on a miss
+        """
+        if self.backend is None:
+            return await load(db)
+        try:
+            generation = await self.backend.get(GENERATION_KEY)
+            if generation is None:
+                generation = secrets.token_hex(8).encode()
+                await self.backend.set(GENERATION_KEY, generation)
+        except BACKEND_ERRORS:
+            logger.warning("Post cache backend failed", exc_info=True)
+            return await load(db)
+        return await self._fetch(f"posts:{generation.decode()}:{name}", db, load)
+
+    async def _fetch(self, key: str, db, load):
+        if self.backend is None:
+            return await load(db)
+        try:
+            value = await self.backend.get(key)
+        except BACKEND_ERRORS:
+            logger.warning("Post cache backend failed", exc_info=True)
+            return await load(db)
+        if value is not None:
+            stored, entry = _decode(value)
+            # missing posts are remembered for as long as they are stored
+            if entry is None or time.time() - stored < self.ttl:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                self._revalidate(key, load)
+            return entry
+        self.misses += 1
+        entry = await self._load(db, load)
+        await self._store(key, entry)
+        return entry
+
+    async def _load(self, db, load):
+        if db is None or not read_router.on_replica(db):
+            return await load(db)
+        async with self.session_scope() as primary:
+            return await load(primary)
+
+    async def _store(self, key: str, entry: Optional[Entry]):
+        if entry is None and self.negative_ttl <= 0:
+            return
+        try:
+            await self.backend.set(key, _encode(entry),
+                                   self.negative_ttl if entry is None else self.ttl + self.stale)
+        except BACKEND_ERRORS:
+            logger.warning("Post cache backend failed", exc_info=True)
+
+    def _revalidate(self, key: str, load):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, load))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: str, load):
+        try:
+            async with self.session_scope() as db:
+                await self._store(key, await load(db))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Refreshing the post cache entry %s failed", key)
+
+    async def invalidate(self, *post_ids: int):
+        """ Drops the entries of the posts and all listings here and on the other workers,
+        call it after the commit of a change
+        """
+        if self.backend is None:
+            return
+        await self._drop(post_ids)
+        if self.notifier is not None:
+            await self.notifier.publish(",".join(map(str, post_ids)))
+
+    async def _drop(self, post_ids):
+        keys = [_post_key(post_id, view) for post_id in post_ids for view in schemas.PostView]
+        try:
+            if keys:
+                await self.backend.delete(*keys)
+            await self.backend.set(GENERATION_KEY, secrets.token_hex(8).encode())
+        except BACKEND_ERRORS:
+            logger.warning("Dropping post cache entries failed", exc_info=True)
+
+    def _received(self, payload: str):
+        # a shared backend has been updated by the sender
+        if self.backend is None or self.backend.shared:
+            return
+        post_ids = [int(post_id) for post_id in payload.split(",") if post_id]
+        task = asyncio.create_task(self._drop(post_ids))
+        self._dropping.add(task)
+        task.add_done_callback(self._dropping.discard)
+
+    async def _resync(self):
+        # invalidations may have been missed while not listening
+        if self.backend is not None and not self.backend.shared:
+            await self.backend.clear()
+
+    async def listen(self, dsn: str):
+        """ Starts exchanging invalidations with the other workers, a failure is logged
+        """
+        notifier = Notifier(dsn, self._received, self._resync)
+        try:
+            await notifier.start()
+        except (asyncpg.PostgresError, OSError):
+            logger.warning("Listening to post cache invalidations failed", exc_info=True)
+            return
+        self.notifier = notifier
+
+    async def close(self):
+        """ Stops listening and releases the backend
+        """
+        if self.notifier is not None:
+            notifier, self.notifier = self.notifier, None
+            await notifier.stop()
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self) -> dict:
+        """ Returns usage counters
+        """
+        lookups = self.hits + self.stale_hits + self.misses
+        return {"backend": type(self.backend).__name__ if self.backend is not None else None,
+                "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+                "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0}
+
+
+def _post_key(post_id: int, view: schemas.PostView) -> str:
+    return f"post:{post_id}:{view.value}"
+
+
+def _encode(entry: Optional[Entry]) -> bytes:
+    """ "<stored at> <etag>\\n<body>", "<stored at>\\n" of a missing post
+    """
+    if entry is None:
+        return b"%f\n" % time.time()
+    return b"%f %s\n%s" % (time.time(), entry.etag.encode(), entry.body)
+
+
+def _decode(value: bytes):
+    """ (stored at, Entry or None) of an _encode value
+    """
+    header, _, body = value.partition(b"\n")
+    stored, _, etag = header.partition(b" ")
+    return float(stored), Entry(etag.decode(), body) if etag else None
+
+
+def make_backend():
+    """ Backend of settings.POST_CACHE_BACKEND
+    """
+    if settings.POST_CACHE_BACKEND == "memory":
+        return MemoryBackend(settings.POST_CACHE_SIZE)
+    if settings.POST_CACHE_BACKEND == "redis":
+        return RedisBackend(settings.POST_CACHE_REDIS_URL, settings.POST_CACHE_REDIS_TIMEOUT)
+    return None
+
+
+post_cache = PostCache(make_backend(), settings.POST_CACHE_TTL_SECONDS,
+                       settings.POST_CACHE_STALE_SECONDS, settings.POST_CACHE_NEGATIVE_TTL_SECONDS,
+                       read_router.primary)
@@ -0,0 +1,56 @@
+""" On-demand profiling of single requests
+
+A request with the header X-Profile: <settings.PROFILING_TOKEN> is run under cProfile
+when settings.PROFILING_ENABLED is on. Its SQL statements are recorded with their
+durations and a report is written to settings.PROFILING_DIR:
+
+- <id>.txt - the statements and the functions with the highest cumulative time
+- <id>.prof - the raw pstats dump, e.g. for snakeviz
+
+The response carries the id in X-Profile-Id.
+
+cProfile records the event loop thread while the request runs, not the request alone:
+other requests served concurrently show up in the report, and work the request hands to
+threads (the sessions of DB_ASYNC=False, password hashing) is missing from it, only the
+time spent waiting for it is. Profile on an otherwise idle worker. The SQL statements
+are the request's own in both modes
+"""
+import cProfile
+import io
+import os
+import pstats
+import time
+import uuid
+from typing import List, Tuple
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# functions listed in the text report
+REPORT_FUNCTIONS = 40
+# scope of the function profile, written in the header of every report
+SCOPE_NOTE = ("Functions: everything run by the event loop thread during the request, "
+              "including other concurrent requests; work run in threads is not included")
+
+
+def write_report(directory: str, request_line: str, status: int, seconds: float,
+                 profile: cProfile.Profile, statements: List[Tuple[str, float]]) -> str:
+    """ Writes the reports of a profiled request, returns their id
+    """
+    report_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(directory, exist_ok=True)
+    profile.dump_stats(os.path.join(directory, f"{report_id}.prof"))
+
+    out = io.StringIO()
+    out.write(f"{request_line} -> {status} in {seconds * 1000:.1f} ms\n")
+    out.write(f"{SCOPE_NOTE}\n\n")
+    sql_seconds = sum(duration for _, duration in statements)
+    out.write(f"{len(statements)} SQL statement(s) in {sql_seconds * 1000:.1f} ms\n")
+    for statement, duration in statements:
+        out.write(f"\n[{duration * 1000:.1f} ms] {statement}\n")
+    out.write("\n")
+    pstats.Stats(profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+        REPORT_FUNCTIONS)
+    with open(os.path.join(directory, f"{report_id}.txt"), "w", encoding="utf-8") as report:
+        report.write(out.getvalue())
+    return report_id
@@ -0,0 +1,56 @@
+""" Repairs drift of the denormalized posts.likes_count column
+
+Run from the root:
+
+    python -m app.reconcile [--batch-size 1000]
+"""
+import argparse
+
+from sqlalchemy import text
+
+from .database import engine
+
+DEFAULT_BATCH_SIZE = 1000
+
+LOCK_BATCH = text(
+    "SELECT id FROM posts WHERE id > :start AND id <= :end ORDER BY id FOR UPDATE")
+
+# only rows that actually drifted are written
+FIX_BATCH = text(
+    "UPDATE posts SET likes_count = counts.likes "
+    "FROM (SELECT posts.id, count(likes.post_id) AS likes FROM posts "
+    "LEFT JOIN likes ON likes.post_id = posts.id "
+    "WHERE posts.id > :start AND posts.id <= :end GROUP BY posts.id) AS counts "
+    "WHERE posts.id = counts.id AND posts.likes_count <> counts.likes "
+    "RETURNING posts.id")
+
+
+def reconcile_likes_count(bind=engine, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """ Recounts likes per post in batches of post ids, returns the number of fixed posts
+
+    Each batch runs in its own transaction and locks its posts rows first, so
+    concurrent likes/dislikes (which update the same rows) are serialized with it
+    """
+    with bind.connect() as conn:
+        max_id = conn.execute(text("SELECT coalesce(max(id), 0) FROM posts")).scalar()
+    fixed = 0
+    for start in range(0, max_id, batch_size):
+        params = {"start": start, "end": start + batch_size}
+        with bind.begin() as conn:
+            conn.execute(LOCK_BATCH, params)
+            fixed += len(conn.execute(FIX_BATCH, params).all())
+    return fixed
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    fixed = reconcile_likes_count(batch_size=args.batch_size)
+    print(f"Fixed likes_count of {fixed} post(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 """
 from fastapi import status, HTTPException, Depends, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models, utils, schemas
 from app.database import get_db
@@ -10,6 +11,7 @@ from app.oauth2 import create_access_token
 
 
 MESSAGE_401 = "401 Failed authentication"
+MESSAGE_503 = "Too many login attempts in progress, retry later"
 
 router = APIRouter(
     tags=["Authentication"]
@@ -17,15 +19,29 @@ router = APIRouter(
 
 
 @router.post("/login", status_code=status.HTTP_201_CREATED, response_model=schemas.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(),
+                db: AsyncSession = Depends(get_db)):
     """ Logins a user
     """
     # OAuth2PasswordRequestForm comes with username and password fields
-    user = db.query(models.User).filter(
-        models.User.email == user_credentials.username).first()
-    if not user or not utils.verify_pwd(user_credentials.password, user.password):
+    user = (await db.execute(select(models.User).filter(
+        models.User.email == user_credentials.username))).scalars().first()
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=MESSAGE_401)
+    try:
+        is_valid, new_hash = await utils.pwd_executor.run(
+            utils.verify_and_update_pwd, user_credentials.password, user.password)
+    except utils.ExecutorOverloaded as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=MESSAGE_503, headers={"Retry-After": "1"}) from e
+    if not is_valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail=MESSAGE_401)
+    if new_hash:
+        # the configured bcrypt cost has changed since the hash was stored
+        user.password = new_hash
+        await db.commit()
     # create token
     access_token = create_access_token(payload={"user_id": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
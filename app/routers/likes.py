@@ -1,11 +1,18 @@
 """ Users  related routes
 """
+from typing import List
+
 from fastapi import status, HTTPException, Depends, APIRouter, Response
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, update, literal, bindparam
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas, oauth2
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, session_scope, violated_constraint, FOREIGN_KEY_VIOLATION
+from app.like_buffer import LikeBuffer, LikeBufferFull, LIKE, DISLIKE
+from app.post_cache import post_cache
 
-MESSAGE_403 = "Unauthorized access"
 MESSAGE_409 = "User can like the same post only once"
 MESSAGE_404 = "Post not found"
 
@@ -15,41 +22,188 @@ router = APIRouter(
 )
 
 MESSAGE_404 = "Post was not found"
+MESSAGE_503 = "Too many likes waiting to be written, retry later"
 
+# used when settings.LIKES_WRITE_BEHIND is on, started and drained by the app
+like_buffer = LikeBuffer(settings.LIKE_BUFFER_MAX_SIZE, settings.LIKE_BUFFER_FLUSH_SECONDS,
+                         session_scope, on_flush=post_cache.invalidate,
+                         max_pending=settings.LIKE_BUFFER_MAX_PENDING)
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def like_post(like: schemas.Like, db: Session = Depends(get_db),
-              current_user: dict = Depends(oauth2.get_current_user)):
-    post = db.query(models.Post).filter(models.Post.id == like.post_id).first()
-    if not post:
+
+def _change_likes_count(changed_likes, delta: int):
+    """ Statement that atomically shifts the denormalized likes counters of the posts
+    returned by a data-modifying CTE of likes, returns the ids of the changed posts
+    """
+    return update(models.Post).filter(models.Post.id == changed_likes.c.post_id).values(
+        likes_count=models.Post.likes_count + delta).returning(models.Post.id).execution_options(
+        synchronize_session=False)
+
+
+# prebuilt like_post / dislike_post statements, parameterized by :like_post_id and :like_user_id
+# (the column names are reserved by the VALUES clause)
+# One round trip: insert the like unless it exists, bump the counter if it was inserted
+ADD_LIKE = _change_likes_count(insert(models.Like).values(
+    post_id=bindparam("like_post_id"), user_id=bindparam("like_user_id")).on_conflict_do_nothing(
+    constraint="_user_post").returning(models.Like.post_id).cte("inserted"), 1)
+# delete the like, decrement the counter if it was deleted
+REMOVE_LIKE = _change_likes_count(delete(models.Like).filter(
+    models.Like.post_id == bindparam("like_post_id"),
+    models.Like.user_id == bindparam("like_user_id")).returning(
+    models.Like.post_id).cte("deleted"), -1)
+
+
+async def _stored_like(db: AsyncSession, user_id: int, post_id: int):
+    """ Returns (post exists, like exists) as stored in the DB
+    """
+    post = select(models.Post.id).filter(models.Post.id == post_id).exists().label("post")
+    like = select(models.Like.id).filter(models.Like.post_id == post_id,
+                                         models.Like.user_id == user_id).exists().label("like")
+    row = (await db.execute(select(post, like))).one()
+    return row.post, row.like
+
+
+async def _is_liked(db: AsyncSession, user_id: int, post_id: int) -> bool:
+    """ Like state as seen by the user: pending buffered changes first, then the DB
+    """
+    pending = like_buffer.state(user_id, post_id)
+    if pending is not None:
+        return pending
+    post_exists, like_exists = await _stored_like(db, user_id, post_id)
+    if not post_exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
-    l = db.query(models.Like).filter(
-        models.Like.post_id == like.post_id).filter(models.Like.user_id == current_user.id).first()
-    if l:
+    return like_exists
+
+
+def _put(user_id: int, post_id: int, liked: bool):
+    """ Buffers a like or a dislike, sheds it with 503 when the buffer is full
+    """
+    try:
+        like_buffer.put(user_id, post_id, liked)
+    except LikeBufferFull as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=MESSAGE_503, headers={"Retry-After": "1"}) from e
+
+
+async def _buffer_like(db: AsyncSession, user_id: int, post_id: int):
+    """ Write-behind like_post: validated against the buffer and the DB, written by the next flush
+    """
+    if await _is_liked(db, user_id, post_id):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=MESSAGE_409)
+    if like_buffer.state(user_id, post_id) is DISLIKE:
+        # the stored like stays
+        like_buffer.cancel(user_id, post_id)
+    else:
+        _put(user_id, post_id, LIKE)
+
 
-    new_like = models.Like(post_id=like.post_id, user_id=current_user.id)
-    db.add(new_like)
-    db.commit()
+async def _buffer_dislike(db: AsyncSession, user_id: int, post_id: int):
+    """ Write-behind dislike_post: validated against the buffer and the DB, written by the
+    next flush
+    """
+    if not await _is_liked(db, user_id, post_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
+    if like_buffer.state(user_id, post_id) is LIKE:
+        # the like was never stored
+        like_buffer.cancel(user_id, post_id)
+    else:
+        _put(user_id, post_id, DISLIKE)
+
+
+@router.get("/{post_id}", response_model=schemas.LikeState)
+async def get_like(post_id: int, db: AsyncSession = Depends(get_db),
+                   current_user: dict = Depends(oauth2.get_current_user)):
+    """ Tells if the current user likes a post, including likes not flushed yet
+    """
+    return {"post_id": post_id, "liked": await _is_liked(db, current_user.id, post_id)}
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def like_post(like: schemas.Like, db: AsyncSession = Depends(get_db),
+                    current_user: dict = Depends(oauth2.get_current_user)):
+    """ Likes a post
+    """
+    if settings.LIKES_WRITE_BEHIND:
+        await _buffer_like(db, current_user.id, like.post_id)
+        return Response(status_code=status.HTTP_201_CREATED)
+    params = {"like_post_id": like.post_id, "like_user_id": current_user.id}
+    try:
+        liked = (await db.execute(ADD_LIKE, params)).scalar()
+    except IntegrityError as e:
+        await db.rollback()
+        if violated_constraint(e, FOREIGN_KEY_VIOLATION):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404) from e
+        raise
+    if liked is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=MESSAGE_409)
+    await db.commit()
+    await post_cache.invalidate(like.post_id)
     return Response(status_code=status.HTTP_201_CREATED)
 
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def dislike_post(like: schemas.Like, db: Session = Depends(get_db),
-                 current_user: dict = Depends(oauth2.get_current_user)):
-    """ Deletes a post with id
-    """
-    like_query = db.query(models.Like).filter(
-        models.Like.post_id == like.post_id).filter(models.Like.user_id == current_user.id)
-    l = like_query.first()
-    if not l:
+async def dislike_post(like: schemas.Like, db: AsyncSession = Depends(get_db),
+                       current_user: dict = Depends(oauth2.get_current_user)):
+    """ Deletes a like of the current user
+    """
+    if settings.LIKES_WRITE_BEHIND:
+        await _buffer_dislike(db, current_user.id, like.post_id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    params = {"like_post_id": like.post_id, "like_user_id": current_user.id}
+    if (await db.execute(REMOVE_LIKE, params)).scalar() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
-    if l.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail=MESSAGE_403)
-    like_query.delete(synchronize_session=False)
-    db.commit()
+    await db.commit()
+    await post_cache.invalidate(like.post_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/batch", status_code=status.HTTP_201_CREATED,
+             response_model=List[schemas.BatchItemResult])
+async def like_posts(likes: schemas.LikeBatch, db: AsyncSession = Depends(get_db),
+                     current_user: dict = Depends(oauth2.get_current_user)):
+    """ Likes posts in bulk, reports per post if the like was created, already existed or the
+    post is missing
+
+    Always written directly, even in the write-behind mode
+    """
+    post_ids = list(dict.fromkeys(like.post_id for like in likes))
+    # one round trip: find the posts, insert the new likes, bump their counters
+    existing = select(models.Post.id).filter(models.Post.id.in_(post_ids)).cte("existing")
+    inserted = insert(models.Like).from_select(
+        ["user_id", "post_id"], select(literal(current_user.id), existing.c.id)
+    ).on_conflict_do_nothing(constraint="_user_post").returning(models.Like.post_id).cte("inserted")
+    counted = _change_likes_count(inserted, 1).cte("counted")
+    statement = select(existing.c.id, counted.c.id.isnot(None).label("created")).join(
+        counted, counted.c.id == existing.c.id, isouter=True)
+    # a post deleted after it was found fails the whole statement, the next attempt
+    # does not find it. Every attempt but the last one loses at least one post
+    for attempt in range(len(post_ids) + 1):
+        try:
+            rows = (await db.execute(statement)).all()
+            break
+        except IntegrityError as e:
+            await db.rollback()
+            if not violated_constraint(e, FOREIGN_KEY_VIOLATION) or attempt == len(post_ids):
+                raise
+    await db.commit()
+
+    created = {row.id: row.created for row in rows}  # post id -> the like is new
+    liked = [post_id for post_id, new in created.items() if new]
+    if liked:
+        await post_cache.invalidate(*liked)
+    results, seen = [], set()
+    for like in likes:
+        if like.post_id not in created:
+            item_status = schemas.BatchItemStatus.MISSING_POST
+        elif like.post_id in seen or not created[like.post_id]:
+            item_status = schemas.BatchItemStatus.DUPLICATE
+        else:
+            item_status = schemas.BatchItemStatus.CREATED
+        seen.add(like.post_id)
+        results.append({"status": item_status, "id": like.post_id})
+    return results
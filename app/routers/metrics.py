@@ -0,0 +1,13 @@
+""" Prometheus scrape route
+"""
+from fastapi import APIRouter, Response
+from app import metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """ Gets the metrics of this worker in the Prometheus text format
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,14 +1,22 @@
 """ Posts related routes
 """
 
-from typing import List, Optional
+from collections import defaultdict
+from functools import lru_cache, partial
+from typing import List, Optional, Union
 
-from fastapi import status, HTTPException, Response, Depends, APIRouter
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import orjson
 
-from app import models, schemas, oauth2
-from app.database import get_db
+from fastapi import status, HTTPException, Response, Depends, APIRouter, Query, Header
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (func, select, insert, delete, update, tuple_, literal_column, bindparam,
+                        Integer)
+
+from app import models, schemas, oauth2, utils
+from app.config import settings
+from app.database import get_db, get_read_db
+from app.post_cache import post_cache, Entry
 
 # TODO security
 # - https://go.snyk.io/rs/677-THP-415/images/Python_Cheatsheet_whitepaper.pdf
@@ -23,76 +31,303 @@ router = APIRouter(
 
 MESSAGE_404 = "Post was not found"
 MESSAGE_403 = "Unauthorized access"
+MESSAGE_400 = "Malformed pagination cursor"
+
+# text search configuration of posts.search_vector
+TS_CONFIG = literal_column("'english'::regconfig")
+
+
+def _post_etag(post_id: int, updated, likes: int, view: schemas.PostView) -> str:
+    """ ETag of a post in a view, its author is immutable
+    """
+    return utils.make_etag(view.value, post_id, updated, likes)
+
+
+def _not_modified(etag: str) -> Response:
+    """ 304 response, the client already has the current representation
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+# all columns of a post except the search document
+POST_COLUMNS = (models.Post.id, models.Post.title, models.Post.content, models.Post.is_published,
+                models.Post.created, models.Post.updated, models.Post.user_id,
+                models.Post.likes_count)
+
+# the summary view, the excerpt is cut by Postgres: the full content is not sent over
+SUMMARY_COLUMNS = tuple(column for column in POST_COLUMNS if column is not models.Post.content) + (
+    func.left(models.Post.content, schemas.EXCERPT_LENGTH).label("excerpt"),)
+
+
+def _listing_select(view: schemas.PostView = schemas.PostView.FULL):
+    """ Flat select of posts in a view and their authors for listings
+
+    Rows are turned into plain dicts by _listing_item and rendered by orjson directly,
+    without ORM objects and without re-running the request validators on stored data
+    """
+    columns = POST_COLUMNS if view is schemas.PostView.FULL else SUMMARY_COLUMNS
+    return select(*columns, models.User.email.label("user_email"),
+                  models.User.created.label("user_created")).join(
+        models.User, models.User.id == models.Post.user_id)
+
+
+def _listing_item(row, view: schemas.PostView = schemas.PostView.FULL) -> dict:
+    """ schemas.PostResponseWithLikes (schemas.PostSummaryWithLikes) shaped dict of
+    a _listing_select row
+    """
+    body = {"content": row.content} if view is schemas.PostView.FULL else {"excerpt": row.excerpt}
+    return {"Post": {"id": row.id, "title": row.title, **body,
+                     "is_published": row.is_published, "created": row.created,
+                     "updated": row.updated, "user_id": row.user_id,
+                     "user": {"id": row.user_id, "email": row.user_email,
+                              "created": row.user_created}},
+            "likes": row.likes_count}
+
+
+@lru_cache(maxsize=None)
+def _listing_page(view: schemas.PostView, search: bool, keyset: bool, after: bool):
+    """ Prebuilt get_posts statement of a combination of options
+
+    Parameterized by :limit plus :skip (limit/skip pages), :pattern (search) and
+    :after_created, :after_id (keyset pages after a cursor), so requests neither rebuild
+    the statement nor recompute its compiled cache key
+    """
+    query = _listing_select(view)
+    if search:
+        # backed by the pg_trgm index of titles
+        query = query.filter(models.Post.title.ilike(bindparam("pattern")))
+    limit = bindparam("limit", type_=Integer)
+    if not keyset:
+        # a stable order, backed by the primary key
+        return query.order_by(models.Post.id).limit(limit).offset(bindparam("skip", type_=Integer))
+    if after:
+        query = query.filter(tuple_(models.Post.created, models.Post.id) < tuple_(
+            bindparam("after_created", type_=models.Post.created.type),
+            bindparam("after_id", type_=Integer)))
+    return query.order_by(models.Post.created.desc(), models.Post.id.desc()).limit(limit)
+
+
+# prebuilt statements of get_post, parameterized by :post_id
+POST_VERSION = select(models.Post.updated, models.Post.likes_count).filter(
+    models.Post.id == bindparam("post_id"))
+POST_BY_ID = {view: _listing_select(view).filter(models.Post.id == bindparam("post_id"))
+              for view in schemas.PostView}
+
+
+def _json_response(entry: Entry) -> Response:
+    """ Response of a rendered post or page
+    """
+    return Response(entry.body, media_type=ORJSONResponse.media_type, headers={"ETag": entry.etag})
+
+
+async def _load_page(db: AsyncSession, view: schemas.PostView, search: str, limit: int, skip: int,
+                     keyset: bool, position: Optional[tuple]) -> Entry:
+    """ Renders a page of get_posts, position - the keyset position of a cursor
+    """
+    params = {"pattern": f"%{search}%"} if search else {}
+    if not keyset:
+        posts = (await db.execute(_listing_page(view, bool(search), False, False),
+                                  {**params, "limit": limit, "skip": skip})).all()
+        etag = utils.make_etag(*(_post_etag(p.id, p.updated, p.likes_count, view) for p in posts))
+        return Entry(etag, orjson.dumps([_listing_item(p, view) for p in posts]))
+
+    if position is not None:
+        params.update(after_created=position[0], after_id=position[1])
+    # one extra row tells if there is a next page
+    posts = (await db.execute(_listing_page(view, bool(search), True, position is not None),
+                              {**params, "limit": limit + 1})).all()
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = utils.encode_cursor(posts[-1].created, posts[-1].id)
+    etag = utils.make_etag(next_cursor,
+                           *(_post_etag(p.id, p.updated, p.likes_count, view) for p in posts))
+    return Entry(etag, orjson.dumps({"results": [_listing_item(p, view) for p in posts],
+                                     "next_cursor": next_cursor}))
 
 
-@router.get("/", response_model=List[schemas.PostResponseWithLikes])
-def get_posts(db: Session = Depends(get_db), _current_user: dict = Depends(oauth2.get_current_user),
-              limit: int = 10, skip: int = 0, search: Optional[str] = ""):
+async def _load_post(db: AsyncSession, post_id: int, view: schemas.PostView) -> Optional[Entry]:
+    """ Renders a post of get_post, None if it does not exist
+    """
+    post = (await db.execute(POST_BY_ID[view], {"post_id": post_id})).first()
+    if not post:
+        return None
+    return Entry(_post_etag(post_id, post.updated, post.likes_count, view),
+                 orjson.dumps(_listing_item(post, view)))
+
+
+async def _raise_missing_or_forbidden(db: AsyncSession, post_id: int):
+    """ Explains why a write restricted to the posts of the current user matched no row
+    """
+    owner_id = (await db.execute(
+        select(models.Post.user_id).filter(models.Post.id == post_id))).scalar()
+    if owner_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail=MESSAGE_403)
+
+
+@router.get("/", response_model=Union[schemas.PostPage, List[schemas.PostResponseWithLikes],
+                                      List[schemas.PostSummaryWithLikes]])
+async def get_posts(db: AsyncSession = Depends(get_read_db),
+                    _current_user: dict = Depends(oauth2.get_current_user),
+                    limit: int = Query(10, gt=0, le=schemas.MAX_LIMIT), skip: int = Query(0, ge=0),
+                    search: Optional[str] = "", cursor: Optional[str] = None,
+                    view: schemas.PostView = schemas.PostView.FULL,
+                    if_none_match: Optional[str] = Header(None)):
     """ Gets all posts
+
+    Without `cursor` returns a list paginated by limit/skip.
+    With `cursor` (empty for the first page) returns newest posts first with `next_cursor`
+    of the next page, so the cost of a page does not depend on its depth.
+    `view=summary` returns an excerpt of content instead of the content
+    """
+    position = None
+    if cursor:
+        try:
+            position = utils.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=MESSAGE_400) from e
+    keyset = cursor is not None
+    load = partial(_load_page, view=view, search=search, limit=limit, skip=skip, keyset=keyset,
+                   position=position)
+    if not search and position is None and (keyset or not skip):
+        # the first pages are the same for everyone
+        name = f"{view.value}:{'keyset' if keyset else 'offset'}:{limit}"
+        page = await post_cache.listing(name, db, load)
+    else:
+        page = await load(db)
+    if utils.etag_matches(if_none_match, page.etag):
+        return _not_modified(page.etag)
+    return _json_response(page)
+
+
+@router.get("/search", response_model=List[schemas.PostResponseWithLikes])
+async def search_posts(q: str = Query(..., min_length=1, max_length=schemas.MAX_TITLE_LENGTH * 4),
+                       db: AsyncSession = Depends(get_read_db),
+                       _current_user: dict = Depends(oauth2.get_current_user),
+                       limit: int = Query(10, gt=0, le=schemas.MAX_LIMIT),
+                       skip: int = Query(0, ge=0)):
+    """ Full-text search of posts by title and content, best matches first
+
+    `q` supports the web search syntax: "quoted phrases", OR, -excluded words
     """
+    ts_query = func.websearch_to_tsquery(TS_CONFIG, q)
+    posts = (await db.execute(_listing_select().filter(
+        models.Post.search_vector.op("@@")(ts_query)).order_by(
+        func.ts_rank(models.Post.search_vector, ts_query).desc(), models.Post.id.desc())
+        .limit(limit).offset(skip))).all()
+    return ORJSONResponse([_listing_item(p) for p in posts])
 
-    posts = db.query(models.Post, func.count(models.Like.post_id).label("likes")).join(
-        models.Like, models.Like.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(
-        models.Post.title.ilike(f"%{search}%")).limit(limit).offset(skip).all()
-    return posts
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts(db: AsyncSession = Depends(get_read_db),
+                       _current_user: dict = Depends(oauth2.get_current_user)):
+    """ Streams all posts as NDJSON with bounded memory (server-side cursor)
+    """
+    result = await db.stream(select(*POST_COLUMNS).order_by(models.Post.id).execution_options(
+        yield_per=settings.EXPORT_BATCH_SIZE))
+    return StreamingResponse(utils.ndjson_lines(result, settings.EXPORT_BATCH_SIZE),
+                             media_type="application/x-ndjson")
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse)
-def create_post(post: schemas.PostCreate, db: Session = Depends(get_db),
-                current_user: dict = Depends(oauth2.get_current_user)):
+async def create_post(post: schemas.PostCreate, db: AsyncSession = Depends(get_db),
+                      current_user: dict = Depends(oauth2.get_current_user)):
     """ Creates a new post
     """
-    new_post = models.Post(user_id=current_user.id, **post.dict())
-    db.add(new_post)
-    db.commit()
-    db.refresh(new_post)  # acts as "RETURNING * " in SQL
-    return new_post
+    new_post = (await db.execute(insert(models.Post).values(user_id=current_user.id, **post.dict())
+                                 .returning(*POST_COLUMNS))).one()
+    await db.commit()
+    # its id may have been cached as missing
+    await post_cache.invalidate(new_post.id)
+    # the author is the current user
+    return {**new_post._mapping, "user": current_user}
 
 
-@router.get("/{post_id}", response_model=schemas.PostResponseWithLikes)
-def get_post(post_id: int, db: Session = Depends(get_db),
-             _current_user: dict = Depends(oauth2.get_current_user)):
-    """ Gets a post by id
+# the columns of a post set by POST /posts/batch
+BATCH_ITEM_COLUMNS = (models.Post.title, models.Post.content, models.Post.is_published)
+
+
+@router.post("/batch", status_code=status.HTTP_201_CREATED,
+             response_model=List[schemas.BatchItemResult])
+async def create_posts(posts: schemas.PostBatch, db: AsyncSession = Depends(get_db),
+                       current_user: dict = Depends(oauth2.get_current_user)):
+    """ Creates posts in bulk with a single multi-row INSERT
     """
-    post = db.query(models.Post, func.count(models.Like.post_id).label("likes")).join(
-        models.Like, models.Like.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(models.Post.id == post_id).first()
-    if not post:
+    items = [post.dict() for post in posts]
+    rows = (await db.execute(insert(models.Post).values(
+        [{**item, "user_id": current_user.id} for item in items]).returning(
+        models.Post.id, *BATCH_ITEM_COLUMNS))).all()
+    await db.commit()
+    # the order of RETURNING is not guaranteed: rows are matched to the items by their values,
+    # identical items are interchangeable
+    ids = defaultdict(list)
+    for row in rows:
+        ids[tuple(getattr(row, column.key) for column in BATCH_ITEM_COLUMNS)].append(row.id)
+    await post_cache.invalidate(*(row.id for row in rows))
+    return [{"status": schemas.BatchItemStatus.CREATED,
+             "id": ids[tuple(item[column.key] for column in BATCH_ITEM_COLUMNS)].pop()}
+            for item in items]
+
+
+@router.get("/{post_id}",
+            response_model=Union[schemas.PostResponseWithLikes, schemas.PostSummaryWithLikes])
+async def get_post(post_id: int, db: AsyncSession = Depends(get_read_db),
+                   _current_user: dict = Depends(oauth2.get_current_user),
+                   view: schemas.PostView = schemas.PostView.FULL,
+                   if_none_match: Optional[str] = Header(None)):
+    """ Gets a post by id, `view=summary` returns an excerpt of content instead of the content
+
+    Supports conditional requests: with a matching If-None-Match returns 304
+    after a version check that does not load the post itself (or from the post cache)
+    """
+    if if_none_match and not post_cache.enabled:
+        version = (await db.execute(POST_VERSION, {"post_id": post_id})).first()
+        if not version:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
+        etag = _post_etag(post_id, version.updated, version.likes_count, view)
+        if utils.etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+    post = await post_cache.post(post_id, view, db, partial(_load_post, post_id=post_id, view=view))
+    if post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
-    return post
+    if utils.etag_matches(if_none_match, post.etag):
+        return _not_modified(post.etag)
+    return _json_response(post)
 
 
 @router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(post_id: int, db: Session = Depends(get_db),
-                current_user: dict = Depends(oauth2.get_current_user)):
+async def delete_post(post_id: int, db: AsyncSession = Depends(get_db),
+                      current_user: dict = Depends(oauth2.get_current_user)):
     """ Deletes a post with id
     """
-    post_query = db.query(models.Post).filter(models.Post.id == post_id)
-    post = post_query.first()
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
-    if post.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail=MESSAGE_403)
-    post_query.delete(synchronize_session=False)
-    db.commit()
+    deleted = (await db.execute(delete(models.Post).filter(
+        models.Post.id == post_id, models.Post.user_id == current_user.id).returning(
+        models.Post.id))).scalar()
+    if deleted is None:
+        await _raise_missing_or_forbidden(db, post_id)
+    await db.commit()
+    await post_cache.invalidate(post_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.put("/{post_id}", response_model=schemas.PostResponse)
-def update_post(updated_post: schemas.PostCreate, post_id: int, db: Session = Depends(get_db),
-                current_user: dict = Depends(oauth2.get_current_user)):
+async def update_post(updated_post: schemas.PostCreate, post_id: int,
+                      db: AsyncSession = Depends(get_db),
+                      current_user: dict = Depends(oauth2.get_current_user)):
     """ Updates a post with id
     """
-    post_query = db.query(models.Post).filter(models.Post.id == post_id)
-    post = post_query.first()
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
-    if post.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail=MESSAGE_403)
-    post_query.update(updated_post.dict(), synchronize_session=False)
-    db.commit()
-    return post_query.first()
+    post = (await db.execute(update(models.Post).filter(
+        models.Post.id == post_id, models.Post.user_id == current_user.id).values(
+        **updated_post.dict(), updated=func.now()).returning(*POST_COLUMNS))).first()
+    if post is None:
+        await _raise_missing_or_forbidden(db, post_id)
+    await db.commit()
+    await post_cache.invalidate(post_id)
+    # the author is the current user
+    return {**post._mapping, "user": current_user}
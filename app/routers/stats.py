@@ -0,0 +1,25 @@
+""" Runtime statistics routes
+"""
+from fastapi import Depends, APIRouter
+from app import oauth2, database, compression
+from app.post_cache import post_cache
+
+router = APIRouter(
+    prefix="/stats",
+    tags=["Stats"]
+)
+
+
+@router.get("/cache")
+async def get_cache_stats(_current_user: dict = Depends(oauth2.get_current_user)):
+    """ Gets hit/miss counters of the in-process caches
+    """
+    return {"auth": oauth2.cache_stats(), "compression": compression.cache_stats(),
+            "statements": database.compiled_cache_stats(), "posts": post_cache.stats()}
+
+
+@router.get("/pool")
+async def get_pool_stats(_current_user: dict = Depends(oauth2.get_current_user)):
+    """ Gets usage and checkout times of the DB connection pools of this worker
+    """
+    return database.pools_stats()
@@ -1,10 +1,14 @@
 """ Users  related routes
 """
-from typing import List
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Response, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas, utils, oauth2
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, get_read_db
 
 
 router = APIRouter(
@@ -14,42 +18,66 @@ router = APIRouter(
 
 MESSAGE_404 = "User was not found"
 MESSAGE_409 = "User with the provided email address already exists"
+MESSAGE_503 = "Too many sign ups in progress, retry later"
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """ Creates a new user
     """
-    existing_user = db.query(models.User).filter(
-        models.User.email == user.email).first()
-    if existing_user:
+    # hash password
+    try:
+        user.password = await utils.pwd_executor.run(utils.hash_pwd, user.password)
+    except utils.ExecutorOverloaded as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=MESSAGE_503, headers={"Retry-After": "1"}) from e
+    # one round trip, the unique email index decides about duplicates (no check-then-insert race)
+    new_user = (await db.execute(insert(models.User).values(**user.dict()).on_conflict_do_nothing(
+        index_elements=[models.User.email]).returning(models.User.id, models.User.email,
+                                                      models.User.created))).first()
+    if new_user is None:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=MESSAGE_409)
-    # hash password
-    user.password = utils.hash_pwd(user.password)
-    new_user = models.User(**user.dict())
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)  # acts as "RETURNING * " in SQL
+    await db.commit()
     return new_user
 
 
 @router.get("/", response_model=List[schemas.UserResponse])
-def get_users(db: Session = Depends(get_db),
-              _current_user: dict = Depends(oauth2.get_current_user)):
-    """ Gets all users
+async def get_users(db: AsyncSession = Depends(get_read_db),
+                    _current_user: dict = Depends(oauth2.get_current_user),
+                    limit: int = Query(10, gt=0, le=schemas.MAX_LIMIT), skip: int = Query(0, ge=0)):
+    """ Gets a page of users, see /users/export for all of them
     """
-    users = db.query(models.User).all()
+    users = (await db.execute(select(models.User).order_by(models.User.id)
+                              .limit(limit).offset(skip))).scalars().all()
     return users
 
 
+@router.get("/export", response_class=StreamingResponse)
+async def export_users(db: AsyncSession = Depends(get_read_db),
+                       _current_user: dict = Depends(oauth2.get_current_user)):
+    """ Streams all users as NDJSON with bounded memory (server-side cursor)
+    """
+    result = await db.stream(select(models.User.id, models.User.email, models.User.created)
+                             .order_by(models.User.id)
+                             .execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+    return StreamingResponse(utils.ndjson_lines(result, settings.EXPORT_BATCH_SIZE),
+                             media_type="application/x-ndjson")
+
+
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db),
-             _current_user: dict = Depends(oauth2.get_current_user)):
-    """ Gets a user by id
+async def get_user(user_id: int, response: Response, db: AsyncSession = Depends(get_read_db),
+                   _current_user: dict = Depends(oauth2.get_current_user),
+                   if_none_match: Optional[str] = Header(None)):
+    """ Gets a user by id, returns 304 if If-None-Match has the current ETag
     """
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = (await db.execute(
+        select(models.User).filter(models.User.id == user_id))).scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=MESSAGE_404)
+    etag = utils.make_etag(user.id, user.email, user.created)
+    if utils.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return user
@@ -1,23 +1,22 @@
 """ Pydantic schemas
 """
-from typing import Optional
+from enum import Enum
+from typing import List, Optional, Union
 from datetime import datetime
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, conlist, validator
+
+from .config import settings
 
 MAX_TITLE_LENGTH = 50
 MIN_TITLE_LENGTH = 2
 MAX_CONTENT_LENGTH = 11000
 MIN_CONTENT_LENGTH = 150
 
-# TODO Add validation for the query parameters here, e.g.
-# from pydantic import Conint
-# class MyModel(BaseModel):
-#     limit: Conint(gt=0, lt=MAX_LIMIT)
-#     skip: Conint(gt=0, lt=MAX_LIMIT)
+# max number of items per page, the query parameters are validated in the routes
+MAX_LIMIT = 100
 
-# @router.get("/", response_model=List[schemas.PostResponseWithLikes])
-# def get_posts(db: Session = Depends(get_db), _current_user: dict = Depends(oauth2.get_current_user),
-#               limit: MyModel.limit, skip: MyModel.skip, search: Optional[str] = ""):
+# characters of content in the summary view of posts
+EXCERPT_LENGTH = 200
 
 
 # Request schemas
@@ -82,7 +81,7 @@ class Token(BaseModel):
 class TokenPayload(BaseModel):
     """ pydantic model for JWT token payload
     """
-    id: Optional[str] = None
+    id: Optional[int] = None
 
 
 class Like(BaseModel):
@@ -92,11 +91,16 @@ class Like(BaseModel):
     def id_check(cls, value):  # pylint: disable=E0213
         """ Validates if provided id conforms to the restrictions
         """
-        if len(value) < 0:
+        if int(value) < 0:
             raise ValueError("ID can not be < 0")
         return value
 
 
+# max number of items per batch request
+PostBatch = conlist(PostCreate, min_items=1, max_items=settings.BATCH_MAX_SIZE)
+LikeBatch = conlist(Like, min_items=1, max_items=settings.BATCH_MAX_SIZE)
+
+
 # Response schemas
 
 
@@ -120,6 +124,7 @@ class PostResponse(PostBase):
     user: UserResponse
     id: int
     created: datetime
+    updated: datetime
 
     class Config:
         """ Allows to convert SQLAlchemy model into Pydantic model
@@ -130,3 +135,57 @@ class PostResponse(PostBase):
 class PostResponseWithLikes(BaseModel):
     Post: PostResponse
     likes: int
+
+
+class PostView(str, Enum):
+    """ Representation of posts: full - with content, summary - with an excerpt of content
+    """
+    FULL = "full"
+    SUMMARY = "summary"
+
+
+class PostSummary(BaseModel):
+    """ pydantic model for the summary view of a post, for feeds
+    """
+    id: int
+    title: str
+    excerpt: str  # first EXCERPT_LENGTH characters of content
+    is_published: bool
+    created: datetime
+    updated: datetime
+    user_id: int
+    user: UserResponse
+
+
+class PostSummaryWithLikes(BaseModel):
+    Post: PostSummary
+    likes: int
+
+
+class PostPage(BaseModel):
+    """ pydantic model for a page of posts in the cursor pagination mode
+    """
+    results: List[Union[PostResponseWithLikes, PostSummaryWithLikes]]
+    next_cursor: Optional[str] = None
+
+
+class BatchItemStatus(str, Enum):
+    """ Outcome of an item of a batch request
+    """
+    CREATED = "created"
+    DUPLICATE = "duplicate"
+    MISSING_POST = "missing_post"
+
+
+class BatchItemResult(BaseModel):
+    """ pydantic model for an item of a batch response, in the order of the request items
+    """
+    status: BatchItemStatus
+    id: Optional[int] = None  # of the created post or of the liked post
+
+
+class LikeState(BaseModel):
+    """ pydantic model for the like state of a post for the current user
+    """
+    post_id: int
+    liked: bool
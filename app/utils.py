@@ -1,9 +1,25 @@
 """ Utilities module
 """
 
+import asyncio
+import base64
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Tuple
+
+import orjson
 from passlib.context import CryptContext
 
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from .config import settings
+
+# hashes with other rounds are reported by verify_and_update_pwd as needing a rehash
+PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
 
 
 def hash_pwd(password: str) -> str:
@@ -16,3 +32,112 @@ def verify_pwd(plain_pwd, hashed_pwd):
     """ Verifies if plain and hashed pwds match
     """
     return PWD_CONTEXT.verify(plain_pwd, hashed_pwd)
+
+
+def verify_and_update_pwd(plain_pwd, hashed_pwd) -> Tuple[bool, Optional[str]]:
+    """ Verifies if plain and hashed pwds match, also returns a new hash
+    if the stored one does not use the configured bcrypt cost
+    """
+    return PWD_CONTEXT.verify_and_update(plain_pwd, hashed_pwd)
+
+
+class ExecutorOverloaded(Exception):
+    """ Raised when a BoundedExecutor has no room for more jobs
+    """
+
+
+class BoundedExecutor:
+    """ Thread pool for CPU heavy jobs with a limited number of waiting jobs
+
+    Keeps bcrypt away from the event loop and from the default threadpool used by
+    the DB sessions, so a burst of logins can not starve the other routes.
+    bcrypt releases the GIL, hence threads rather than processes
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_pending = workers + max_queued
+        self.pending = 0  # running + queued jobs, only changed on the event loop
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, func, *args):
+        """ Runs func(*args) in the pool, raises ExecutorOverloaded instead of queueing too
+        many jobs
+        """
+        if self.pending >= self.max_pending:
+            raise ExecutorOverloaded()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="pwd")
+        future = self._executor.submit(func, *args)
+        self.pending += 1
+        # a cancelled caller can not stop a running job, the job is counted until it ends
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: _call_soon(loop, self._finished))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self):
+        self.pending -= 1
+
+    async def shutdown(self):
+        """ Waits for the running jobs and stops the workers, the next job starts new ones
+        """
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, callback):
+    """ Schedules callback on loop from any thread, nothing if the loop is closed
+    """
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass
+
+
+pwd_executor = BoundedExecutor(settings.PWD_HASH_WORKERS or os.cpu_count() or 1,
+                               settings.PWD_HASH_QUEUE_SIZE)
+
+
+def encode_cursor(created: datetime, row_id: int) -> str:
+    """ Encodes a (created, id) keyset position into an opaque cursor
+    """
+    raw = json.dumps([created.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ Decodes an opaque cursor into a (created, id) keyset position, raises ValueError
+    if malformed
+    """
+    try:
+        created, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created), int(row_id)
+    except (TypeError, ValueError) as e:  # includes binascii and JSON decoding errors
+        raise ValueError("Malformed cursor") from e
+
+
+def make_etag(*versions) -> str:
+    """ Builds a strong ETag out of values that change whenever the representation changes
+    """
+    return f'"{hashlib.blake2b(repr(versions).encode(), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """ Checks an If-None-Match header against an ETag
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def ndjson_lines(result, batch_size: int):
+    """ Renders a streamed (server-side cursor) result as NDJSON, one chunk per batch of rows
+    """
+    try:
+        async for rows in result.partitions(batch_size):
+            yield b"".join(orjson.dumps(dict(row._mapping)) + b"\n" for row in rows)
+    finally:
+        await result.close()
@@ -0,0 +1,2 @@
+"""Benchmarks, run from the root as modules, e.g. `python -m benchmarks.password_hashing`
+"""
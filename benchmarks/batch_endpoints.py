@@ -0,0 +1,82 @@
+"""Throughput of the batch endpoints versus the single-item ones
+
+    python -m benchmarks.batch_endpoints [--items 500] [--batch-size 100]
+
+Runs the app in-process and WRITES posts and likes to the configured DB.
+Prints one JSON line per endpoint
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from app.main import app
+from app.schemas import MIN_CONTENT_LENGTH
+
+CONTENT = "x" * MIN_CONTENT_LENGTH * 4
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    """ Signs up a throwaway user, returns its auth headers
+    """
+    email = f"bench-{uuid.uuid4().hex[:8]}@bench.com"
+    await client.post("/users/", json={"email": email, "password": "password"})
+    token = (await client.post("/login", data={"username": email, "password": "password"})).json()
+    return {"Authorization": f"Bearer {token['access_token']}"}
+
+
+async def timed(name: str, items: int, requests) -> dict:
+    """ Awaits the requests one after another, returns the items per second
+    """
+    start = time.perf_counter()
+    for request in requests:
+        response = await request
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return {"benchmark": "batch_endpoints", "endpoint": name, "items": items,
+            "items_per_second": round(items / elapsed, 2)}
+
+
+async def run(items: int, batch_size: int):
+    """ Creates and likes `items` posts through both kinds of endpoints
+    """
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        headers = await login(client)
+        post = {"title": "bench", "content": CONTENT}
+        print(json.dumps(await timed("POST /posts/", items, (
+            client.post("/posts/", json=post, headers=headers) for _ in range(items)))))
+        batches = [[post] * batch_size for _ in range(items // batch_size)]
+        print(json.dumps(await timed("POST /posts/batch", items, (
+            client.post("/posts/batch", json=batch, headers=headers) for batch in batches))))
+
+        # posts to like, by two fresh users
+        post_ids = []
+        for batch in batches:
+            post_ids += [item["id"] for item in (await client.post(
+                "/posts/batch", json=batch, headers=headers)).json()]
+        headers = await login(client)
+        print(json.dumps(await timed("POST /like/", len(post_ids), (
+            client.post("/like/", json={"post_id": post_id}, headers=headers)
+            for post_id in post_ids))))
+        headers = await login(client)
+        print(json.dumps(await timed("POST /like/batch", len(post_ids), (
+            client.post("/like/batch",
+                        json=[{"post_id": post_id} for post_id in post_ids[i:i + batch_size]],
+                        headers=headers) for i in range(0, len(post_ids), batch_size)))))
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
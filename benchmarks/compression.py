@@ -0,0 +1,89 @@
+"""Bytes on the wire and CPU per GET /posts page: identity versus gzip and brotli, cold and cached
+
+    python -m benchmarks.compression [--rows 10] [--repeat 200]
+
+No DB needed. Prints one JSON line per encoding
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+from app import compression
+from app.middleware import CompressionMiddleware
+from app.routers.posts import _listing_item
+from app.utils import make_etag
+from app.schemas import MAX_CONTENT_LENGTH, MIN_CONTENT_LENGTH
+from benchmarks.seed import random_text
+from benchmarks.serialization import ListingRow, make_posts
+
+
+def make_app(body: list):
+    """ App serving a fixed listing page with an ETag, behind CompressionMiddleware
+    """
+    app = FastAPI()
+    etag = make_etag(len(body))
+
+    @app.get("/posts/")
+    async def get_posts():
+        return ORJSONResponse(body, headers={"ETag": etag})
+
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+async def measure(app, encoding: str, repeat: int, cached: bool) -> dict:
+    """ Sends `repeat` requests, returns the mean microseconds per request and the body size
+    """
+    headers = [(b"accept-encoding", encoding.encode())]
+    sizes = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            sizes.append(len(message.get("body", b"")))
+
+    elapsed = 0.0
+    for _ in range(repeat):
+        if not cached:
+            compression.compressed_cache.clear()
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": "/posts/", "raw_path": b"/posts/", "query_string": b"",
+                 "root_path": "", "headers": headers, "server": ("bench", 80)}
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        elapsed += time.perf_counter() - start
+    return {"us_per_request": round(elapsed / repeat * 1e6, 1), "bytes": sizes[-1]}
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    posts = make_posts(args.rows)
+    for post in posts:
+        # compresses like real text, unlike the repeated characters of make_posts
+        post.content = random_text(rng, MIN_CONTENT_LENGTH, MAX_CONTENT_LENGTH,
+                                   MAX_CONTENT_LENGTH // 2)
+    app = make_app([_listing_item(ListingRow(post)) for post in posts])
+    for encoding in ("identity",) + compression.supported_encodings():
+        cold = asyncio.run(measure(app, encoding, args.repeat, cached=False))
+        cached = asyncio.run(measure(app, encoding, args.repeat, cached=True))
+        print(json.dumps({"benchmark": "compression", "encoding": encoding, "rows": args.rows,
+                          "bytes": cold["bytes"], "us_per_request_cold": cold["us_per_request"],
+                          "us_per_request_cached": cached["us_per_request"]}))
+
+
+if __name__ == "__main__":
+    main()
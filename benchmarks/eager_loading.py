@@ -0,0 +1,49 @@
+"""Loading posts with their authors: joinedload versus selectinload
+
+    python -m benchmarks.eager_loading [--posts 10] [--repeat 200]
+
+Runs read-only queries against the posts of the configured DB.
+Prints one JSON line per strategy and page size
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import models
+from app.database import SessionLocal, count_queries
+
+
+def measure(loader, limit: int, repeat: int) -> dict:
+    """ Loads `limit` posts with their authors `repeat` times
+    """
+    with SessionLocal() as db, count_queries() as counter:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            posts = db.execute(select(models.Post).options(loader(models.Post.user))
+                               .order_by(models.Post.id.desc()).limit(limit)).scalars().all()
+            assert all(post.user.email for post in posts)
+            db.expunge_all()
+        elapsed = time.perf_counter() - start
+    return {"ms_per_load": round(elapsed / repeat * 1000, 3),
+            "queries_per_load": counter.count / repeat}
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, loader in (("joinedload", joinedload), ("selectinload", selectinload)):
+        for limit in (1, args.posts):
+            print(json.dumps({"benchmark": "eager_loading", "strategy": name, "posts": limit,
+                              **measure(loader, limit, args.repeat)}))
+
+
+if __name__ == "__main__":
+    main()
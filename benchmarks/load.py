@@ -0,0 +1,179 @@
+"""Throughput and latency percentiles of the hot endpoints at a fixed concurrency
+
+    python -m benchmarks.load [--url http://localhost:8000] [--concurrency 16] [--requests 1000]
+                              [--scenario get_posts ...] [--users 16]
+
+Needs data of benchmarks.seed in the configured DB, which is also read for post ids
+and cursors. Without --url the app runs in-process. like_dislike and create_post WRITE.
+Prints one JSON line per scenario, tagged with the git commit for diffing runs
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+
+import httpx
+from sqlalchemy import text
+
+from app.database import engine
+from app.main import app
+from app.utils import encode_cursor
+from benchmarks.seed import EMAIL, PASSWORD, WORDS
+
+CONTENT = " ".join(WORDS) * 4
+
+
+class Target:
+    """ What the scenarios need to know about the seeded data
+    """
+
+    def __init__(self, rng: random.Random):
+        with engine.connect() as conn:
+            self.user_ids = conn.execute(text(
+                "SELECT id FROM users WHERE email LIKE 'seed-%' ORDER BY id")).scalars().all()
+            self.post_ids = conn.execute(text("SELECT id FROM posts ORDER BY id")).scalars().all()
+            # keyset positions around the middle of the newest-first order
+            self.deep_cursors = [encode_cursor(row.created, row.id) for row in conn.execute(text(
+                "SELECT created, id FROM posts ORDER BY created DESC, id DESC "
+                "OFFSET :offset LIMIT 100"),
+                {"offset": len(self.post_ids) // 2})]
+        if not self.user_ids or not self.post_ids:
+            raise SystemExit("No seeded data, run python -m benchmarks.seed first")
+        self.rng = rng
+        self.tokens = []
+
+    def credentials(self) -> dict:
+        return {"username": EMAIL.format(self.rng.choice(self.user_ids)), "password": PASSWORD}
+
+    def headers(self, worker: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[worker % len(self.tokens)]}"}
+
+
+async def _like_dislike(client: httpx.AsyncClient, target: Target, worker: int) -> httpx.Response:
+    """ Likes a post and takes the like back, 409/404 mean another worker of the same user
+    got there first
+    """
+    like = {"post_id": target.rng.choice(target.post_ids)}
+    response = await client.post("/like/", json=like, headers=target.headers(worker))
+    if response.status_code == 201:
+        response = await client.request("DELETE", "/like/", json=like,
+                                        headers=target.headers(worker))
+    return response
+
+
+# scenario -> coroutine function (client, target, worker) sending one operation
+SCENARIOS = {
+    "login": lambda client, target, worker: client.post("/login", data=target.credentials()),
+    "get_posts": lambda client, target, worker: client.get(
+        "/posts/", params={"limit": 10}, headers=target.headers(worker)),
+    "get_posts_summary": lambda client, target, worker: client.get(
+        "/posts/", params={"limit": 10, "view": "summary"}, headers=target.headers(worker)),
+    "get_posts_deep_offset": lambda client, target, worker: client.get(
+        "/posts/", params={"limit": 10, "skip": target.rng.randrange(len(target.post_ids) // 2,
+                                                                     len(target.post_ids))},
+        headers=target.headers(worker)),
+    "get_posts_deep_cursor": lambda client, target, worker: client.get(
+        "/posts/", params={"limit": 10, "cursor": target.rng.choice(target.deep_cursors)},
+        headers=target.headers(worker)),
+    "get_posts_title_search": lambda client, target, worker: client.get(
+        "/posts/", params={"limit": 10, "search": target.rng.choice(WORDS)},
+        headers=target.headers(worker)),
+    "search_posts": lambda client, target, worker: client.get(
+        "/posts/search", params={"q": target.rng.choice(WORDS)}, headers=target.headers(worker)),
+    "get_post": lambda client, target, worker: client.get(
+        f"/posts/{target.rng.choice(target.post_ids)}", headers=target.headers(worker)),
+    "like_dislike": _like_dislike,
+    "create_post": lambda client, target, worker: client.post(
+        "/posts/", json={"title": "load test", "content": CONTENT}, headers=target.headers(worker)),
+}
+
+
+def percentile(sorted_values: list, share: float) -> float:
+    """ Nearest-rank percentile of sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(share * len(sorted_values)) - 1))]
+
+
+async def run_scenario(client: httpx.AsyncClient, target: Target, name: str, concurrency: int,
+                       requests: int) -> dict:
+    """ Sends `requests` operations from `concurrency` workers, returns the throughput and latencies
+    """
+    send = SCENARIOS[name]
+    remaining = iter(range(requests))
+    latencies, statuses = [], Counter()
+
+    async def worker(index: int):
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status = (await send(client, target, index)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"scenario": name, "concurrency": concurrency, "requests": requests,
+            "seconds": round(elapsed, 3), "rps": round(requests / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "statuses": dict(statuses)}
+
+
+def git_commit() -> str:
+    """ Commit of the working tree, None outside of a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(url: str, scenarios: list, concurrency: int, requests: int, users: int, seed: int):
+    """ Logs the workers in and runs the scenarios one after another
+    """
+    target = Target(random.Random(seed))
+    limits = httpx.Limits(max_connections=concurrency)
+    client_args = {"base_url": url, "limits": limits, "timeout": 60} if url else {
+        "app": app, "base_url": "http://bench", "timeout": 60}
+    commit = git_commit()
+    async with httpx.AsyncClient(**client_args) as client:
+        for _ in range(users):
+            response = await client.post("/login", data=target.credentials())
+            response.raise_for_status()
+            target.tokens.append(response.json()["access_token"])
+        for name in scenarios:
+            result = await run_scenario(client, target, name, concurrency, requests)
+            print(json.dumps({"benchmark": "load", "commit": commit, "target": url or "in-process",
+                              **result}), flush=True)
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running server, in-process if omitted")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="operations per scenario")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="repeatable, all scenarios by default")
+    parser.add_argument("--users", type=int, default=16,
+                        help="seeded users logged in for the workers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.scenario or list(SCENARIOS), args.concurrency, args.requests,
+                    args.users, args.seed))
+
+
+if __name__ == "__main__":
+    main()
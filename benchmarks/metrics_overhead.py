@@ -0,0 +1,91 @@
+"""Cost of the always-on instrumentation: request metrics and SQL timing hooks
+
+    python -m benchmarks.metrics_overhead [--requests 20000]
+
+MetricsMiddleware is measured per request, the SQL timing hooks per statement.
+Prints one JSON line per measurement, no DB needed
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from app.database import count_queries, _count_query, _time_query
+from app.middleware import MetricsMiddleware, QueryCountMiddleware
+
+
+def make_app(instrumented: bool):
+    """ One route app with the middlewares of app.main, with or without MetricsMiddleware
+    """
+    app = FastAPI()
+
+    @app.get("/items/{item_id}", response_class=PlainTextResponse)
+    async def get_item(item_id: int):
+        return str(item_id)
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    app.add_middleware(QueryCountMiddleware)
+    return app
+
+
+async def measure_requests(app, requests: int) -> float:
+    """ Returns the mean microseconds per ASGI request
+    """
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(_message):
+        pass
+
+    start = time.perf_counter()
+    for i in range(requests):
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": f"/items/{i}", "raw_path": f"/items/{i}".encode(),
+                 "query_string": b"", "root_path": "", "headers": [], "server": ("test", 80)}
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+class Connection:
+    """ Stand-in for the Connection passed to the engine events
+    """
+
+    def __init__(self):
+        self.info = {}
+
+
+def measure_hooks(statements: int) -> float:
+    """ Returns the mean microseconds the cursor execute hooks add per statement
+    """
+    conn = Connection()
+    with count_queries():
+        start = time.perf_counter()
+        for _ in range(statements):
+            _count_query(conn, None, "SELECT 1", None, None, False)
+            _time_query(conn, None, "SELECT 1", None, None, False)
+    return (time.perf_counter() - start) / statements * 1e6
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    plain = asyncio.run(measure_requests(make_app(False), args.requests))
+    instrumented = asyncio.run(measure_requests(make_app(True), args.requests))
+    print(json.dumps({"benchmark": "metrics_overhead", "path": "request", "requests": args.requests,
+                      "us_plain": round(plain, 2), "us_instrumented": round(instrumented, 2),
+                      "us_overhead": round(instrumented - plain, 2)}))
+    print(json.dumps({"benchmark": "metrics_overhead", "path": "sql_hooks",
+                      "statements": args.requests,
+                      "us_per_statement": round(measure_hooks(args.requests), 3)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Login (bcrypt verification) throughput versus the size of the password hashing pool
+
+    python -m benchmarks.password_hashing [--logins 64] [--max-workers N]
+
+Prints one JSON line per pool size
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from app import utils
+
+
+async def run_logins(executor: utils.BoundedExecutor, hashed: str, logins: int) -> float:
+    """ Verifies `logins` passwords concurrently, returns the elapsed seconds
+    """
+    start = time.perf_counter()
+    await asyncio.gather(*(executor.run(utils.verify_pwd, "password", hashed)
+                           for _ in range(logins)))
+    return time.perf_counter() - start
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--max-workers", type=int, default=(os.cpu_count() or 1) * 2)
+    args = parser.parse_args()
+
+    hashed = utils.hash_pwd("password")
+    workers = 1
+    while workers <= args.max_workers:
+        executor = utils.BoundedExecutor(workers, max_queued=args.logins)
+        elapsed = asyncio.run(run_logins(executor, hashed, args.logins))
+        asyncio.run(executor.shutdown())
+        print(json.dumps({"benchmark": "password_hashing", "cores": os.cpu_count(),
+                          "workers": workers, "rounds": utils.settings.BCRYPT_ROUNDS,
+                          "logins": args.logins,
+                          "logins_per_second": round(args.logins / elapsed, 2)}))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Synthetic data for the load benchmarks: users, posts and skewed likes, loaded with COPY
+
+    python -m benchmarks.seed [--users 1000] [--posts 20000] [--likes 200000] [--skew 1.1]
+                              [--seed 0]
+
+APPENDS to the configured DB. Seeded users are seed-<id>@bench.com with the password
+`password`. Post contents follow a log-normal length distribution within the schema limits,
+likes follow a Zipf-like popularity of posts (a few viral posts, a long tail).
+Prints one JSON line with the volumes and the time spent
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import schemas
+from app.database import engine
+from app.utils import hash_pwd
+
+EMAIL = "seed-{}@bench.com"
+PASSWORD = "password"
+
+# rows per COPY round trip
+CHUNK_SIZE = 50000
+
+WORDS = ("python api postgres index query cache latency request async pool replica "
+         "like post user search page cursor vacuum lock commit batch stream token "
+         "fastapi sqlalchemy benchmark profile metrics deploy worker queue json").split()
+
+
+def random_text(rng: random.Random, min_length: int, max_length: int, median: int) -> str:
+    """ Words up to a log-normally distributed length within [min_length, max_length]
+    """
+    length = int(rng.lognormvariate(math.log(median), 0.8))
+    length = min(max(length, min_length), max_length)
+    words, size = [], 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:max_length].rstrip().ljust(min_length, ".")
+
+
+def _copy(cursor, table: str, columns: tuple, rows):
+    """ Streams rows into a table with COPY, CHUNK_SIZE rows per round trip
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                           buffer)
+
+
+def _skewed_likes(rng: random.Random, user_ids: range, post_ids: range, likes: int,
+                  skew: float) -> set:
+    """ Unique (user_id, post_id) pairs, post popularity ~ 1 / rank ** skew
+    """
+    ranked = list(post_ids)
+    rng.shuffle(ranked)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, len(ranked) + 1)))
+    pairs = set()
+    # popular posts run out of new likers, give up after a bounded number of draws
+    for _ in range(10):
+        missing = likes - len(pairs)
+        if missing <= 0:
+            break
+        for post_id in rng.choices(ranked, cum_weights=cum_weights, k=missing):
+            pairs.add((rng.choice(user_ids), post_id))
+    return pairs
+
+
+def seed(users: int, posts: int, likes: int, skew: float, seed_value: int, bind=engine) -> dict:
+    """ Appends the synthetic rows, returns what was written
+    """
+    rng = random.Random(seed_value)
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        ids = {}
+        for table in ("users", "posts", "likes"):
+            cursor.execute(f"SELECT coalesce(max(id), 0) FROM {table}")
+            ids[table] = cursor.fetchone()[0]
+        user_ids = range(ids["users"] + 1, ids["users"] + users + 1)
+        post_ids = range(ids["posts"] + 1, ids["posts"] + posts + 1)
+        like_pairs = set()
+        if users and posts:
+            like_pairs = _skewed_likes(rng, user_ids, post_ids, likes, skew)
+        likes_count = {}
+        for _, post_id in like_pairs:
+            likes_count[post_id] = likes_count.get(post_id, 0) + 1
+
+        now = datetime.now(timezone.utc)
+        password = hash_pwd(PASSWORD)  # one hash, bcrypt would dominate the seeding time
+        _copy(cursor, "users", ("id", "email", "password", "created"),
+              ((user_id, EMAIL.format(user_id), password, now) for user_id in user_ids))
+        dated = ((post_id, now - timedelta(seconds=rng.randrange(365 * 24 * 3600)))
+                 for post_id in post_ids)
+        columns = ("id", "title", "content", "created", "updated", "user_id", "likes_count")
+        _copy(cursor, "posts", columns, (
+            (post_id, random_text(rng, schemas.MIN_TITLE_LENGTH, schemas.MAX_TITLE_LENGTH, 30),
+             random_text(rng, schemas.MIN_CONTENT_LENGTH, schemas.MAX_CONTENT_LENGTH, 1200),
+             created, created, rng.choice(user_ids), likes_count.get(post_id, 0))
+            for post_id, created in dated))
+        _copy(cursor, "likes", ("id", "user_id", "post_id"), (
+            (like_id, user_id, post_id) for like_id, (user_id, post_id) in enumerate(
+                sorted(like_pairs), start=ids["likes"] + 1)))
+        # later inserts continue after the copied ids
+        for table in ("users", "posts", "likes"):
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                           f"greatest((SELECT max(id) FROM {table}), 1))")
+        cursor.execute("ANALYZE users, posts, likes")
+        connection.commit()
+    finally:
+        connection.close()
+    return {"users": users, "posts": posts, "likes": len(like_pairs),
+            "max_likes_per_post": max(likes_count.values(), default=0)}
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--likes", type=int, default=200000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of post popularity")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed, same volumes and seed - same data")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    result = seed(args.users, args.posts, args.likes, args.skew, args.seed)
+    print(json.dumps({"benchmark": "seed", **result,
+                      "seconds": round(time.perf_counter() - start, 2)}))
+
+
+if __name__ == "__main__":
+    main()
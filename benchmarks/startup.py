@@ -0,0 +1,111 @@
+"""Import time of app.main and time-to-first-200 of a fresh server process
+
+    python -m benchmarks.startup [--runs 5] [--pool-warmup 2]
+
+Starts uvicorn once per run and times how long it takes to answer GET / (warm-up
+included, the server listens once the lifespan startup is done), then the first
+login and the first and second GET /posts/ of a user of benchmarks.seed, which has
+to be loaded in the configured DB. --pool-warmup 0 compares against connecting on demand.
+Prints one JSON line of medians, tagged with the git commit for diffing runs
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import text
+
+from app.database import engine
+from benchmarks.load import git_commit
+from benchmarks.seed import EMAIL, PASSWORD
+
+IMPORT_SCRIPT = ("import time; start = time.perf_counter(); import app.main; "
+                 "print(time.perf_counter() - start)")
+# seconds to wait for a server to come up
+STARTUP_TIMEOUT = 60
+
+
+def import_seconds() -> float:
+    """ Time to import app.main in a fresh interpreter
+    """
+    return float(subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], text=True))
+
+
+def free_port() -> int:
+    """ A port nobody listens on
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def timed(func, *args, **kwargs):
+    """ (result, seconds) of a call
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def serve_once(credentials: dict, pool_warmup: int) -> dict:
+    """ Starts a server, times its first requests and stops it
+    """
+    port = free_port()
+    env = {**os.environ, "DB_POOL_WARMUP": str(pool_warmup)}
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--log-level", "warning"], env=env)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while True:
+                try:
+                    if client.get("/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() - start > STARTUP_TIMEOUT or server.poll() is not None:
+                    raise RuntimeError("The server did not start")
+                time.sleep(0.01)
+            first_200 = time.perf_counter() - start
+            response, login = timed(client.post, "/login", data=credentials)
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            _, first_posts = timed(client.get, "/posts/", headers=headers)
+            _, second_posts = timed(client.get, "/posts/", headers=headers)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"first_200_seconds": first_200, "first_login_seconds": login,
+            "first_get_posts_seconds": first_posts, "second_get_posts_seconds": second_posts}
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--pool-warmup", type=int, default=2, help="DB_POOL_WARMUP of the servers")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        user_id = conn.execute(text("SELECT min(id) FROM users WHERE email LIKE 'seed-%'")).scalar()
+    if user_id is None:
+        sys.exit("No seeded users, run python -m benchmarks.seed first")
+    credentials = {"username": EMAIL.format(user_id), "password": PASSWORD}
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    runs = [serve_once(credentials, args.pool_warmup) for _ in range(args.runs)]
+    result = {"import_seconds": statistics.median(imports)}
+    for key in runs[0]:
+        result[key] = statistics.median(run[key] for run in runs)
+    print(json.dumps({"benchmark": "startup", "commit": git_commit(), "runs": args.runs,
+                      "pool_warmup": args.pool_warmup, **result}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""CPU cost of the hot route statements built per request versus the prebuilt ones
+
+    python -m benchmarks.statement_cache [--executions 2000]
+
+Executes each statement of get_current_user, get_post, get_posts and like_post both
+ways through a sync Session and measures the process CPU time per execution, so the
+client side cost (statement construction, cache key, compiled cache lookup, result
+processing) is compared while the DB work is the same. Needs data of benchmarks.seed
+in the configured DB, like_post runs in rolled back transactions.
+Prints one JSON line per statement
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app import models, oauth2, schemas
+from app.database import engine
+from app.routers import likes, posts
+
+
+def adhoc_statements(user_id: int, post_id: int) -> dict:
+    """ name -> (statement factory, params) as the routes built them before the prebuilt statements
+    """
+    def like_post():
+        inserted = insert(models.Like).values(
+            post_id=post_id, user_id=user_id).on_conflict_do_nothing(
+            constraint="_user_post").returning(models.Like.post_id).cte("inserted")
+        return likes._change_likes_count(inserted, 1)  # pylint: disable=protected-access
+
+    return {
+        "get_current_user": (lambda: select(models.User).filter(models.User.id == user_id), None),
+        "get_post": (lambda: posts._listing_select().filter(  # pylint: disable=protected-access
+            models.Post.id == post_id), None),
+        "get_posts": (lambda: posts._listing_select().order_by(  # pylint: disable=protected-access
+            models.Post.id).limit(10).offset(0), None),
+        "like_post": (like_post, None),
+    }
+
+
+def prebuilt_statements(user_id: int, post_id: int) -> dict:
+    """ name -> (statement factory, params) of the prebuilt statements of the routes
+    """
+    listing = posts._listing_page(  # pylint: disable=protected-access
+        schemas.PostView.FULL, False, False, False)
+    return {
+        "get_current_user": (lambda: oauth2.USER_BY_ID, {"user_id": user_id}),
+        "get_post": (lambda: posts.POST_BY_ID[schemas.PostView.FULL], {"post_id": post_id}),
+        "get_posts": (lambda: listing, {"limit": 10, "skip": 0}),
+        "like_post": (lambda: likes.ADD_LIKE, {"like_post_id": post_id, "like_user_id": user_id}),
+    }
+
+
+def measure(session: Session, factory, params, executions: int) -> float:
+    """ Returns the mean CPU microseconds per execution
+    """
+    def execute():
+        session.execute(factory(), params).all()
+        session.rollback()
+
+    # compiles and warms up the caches
+    for _ in range(min(executions, 100)):
+        execute()
+    start = time.process_time()
+    for _ in range(executions):
+        execute()
+    return (time.process_time() - start) / executions * 1e6
+
+
+def main():
+    """ Command line entrypoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--executions", type=int, default=2000)
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        user_id = conn.execute(text("SELECT min(id) FROM users")).scalar()
+        # a post the user has not liked, so like_post inserts every time
+        post_id = conn.execute(text(
+            "SELECT min(id) FROM posts "
+            "WHERE id NOT IN (SELECT post_id FROM likes WHERE user_id = :user_id)"),
+            {"user_id": user_id}).scalar()
+    if post_id is None:
+        raise SystemExit("No seeded data, run python -m benchmarks.seed first")
+
+    adhoc, prebuilt = adhoc_statements(user_id, post_id), prebuilt_statements(user_id, post_id)
+    with Session(engine) as session:
+        for name in adhoc:
+            before = measure(session, *adhoc[name], args.executions)
+            after = measure(session, *prebuilt[name], args.executions)
+            print(json.dumps({"benchmark": "statement_cache", "statement": name,
+                              "executions": args.executions, "cpu_us_adhoc": round(before, 1),
+                              "cpu_us_prebuilt": round(after, 1),
+                              "cpu_us_saved": round(before - after, 1)}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Test module for admission control
+"""
+import asyncio
+
+from app import admission
+from app.admission import AdmissionGate
+from .utils import client, test_user, authorized_client
+import pytest
+
+
+def test_gate_queues_and_sheds():
+    async def scenario():
+        gate = AdmissionGate(concurrency=1, queue_size=1, timeout=1)
+        assert await gate.acquire()
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.queued == 1
+        # the queue is full
+        assert not await gate.acquire()
+
+        gate.release(0.01)
+        assert await waiting
+        assert gate.active == 1 and gate.queued == 0 and gate.shed == 1
+        gate.release(0.01)
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_gate_sheds_on_deadline():
+    async def scenario():
+        gate = AdmissionGate(concurrency=1, queue_size=10, timeout=0.05)
+        assert await gate.acquire()
+        # times out in the queue
+        assert not await gate.acquire()
+        assert gate.queued == 0
+        # slow requests: the expected wait already exceeds the timeout, shed without waiting
+        gate.service_seconds = 1
+        assert not await asyncio.wait_for(gate.acquire(), 0.01)
+        assert gate.shed == 2
+
+    asyncio.run(scenario())
+
+
+def test_gate_cancelled_waiter_leaves_queue():
+    async def scenario():
+        gate = AdmissionGate(concurrency=1, queue_size=1, timeout=1)
+        assert await gate.acquire()
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert gate.queued == 0
+        gate.release(0.01)
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_gate_cancelled_waiter_passes_on_its_slot():
+    async def scenario():
+        gate = AdmissionGate(concurrency=1, queue_size=2, timeout=1)
+        assert await gate.acquire()
+        first = asyncio.create_task(gate.acquire())
+        second = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        gate.release(0.5)
+        service_seconds = gate.service_seconds
+        # handed the slot, cancelled before it resumed
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second
+        assert gate.active == 1 and gate.service_seconds == service_seconds
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("method, path, group", [
+    ("POST", "/login", admission.AUTH), ("POST", "/users/", admission.AUTH),
+    ("GET", "/users/1", admission.READ), ("GET", "/posts/", admission.READ),
+    ("PUT", "/posts/1", admission.WRITE), ("GET", "/metrics", None)])
+def test_route_group(method, path, group):
+    assert admission.route_group(method, path) == group
+
+
+def test_overloaded_reads_do_not_shed_logins(authorized_client, test_user, monkeypatch):
+    monkeypatch.setitem(admission.gates, admission.READ,
+                        AdmissionGate(concurrency=0, queue_size=0, timeout=1))
+
+    response = authorized_client.get("/posts/")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    response = authorized_client.post(
+        "/login", data={"username": test_user["email"], "password": test_user["password"]})
+    assert response.status_code == 201
+    assert 'admission_shed_total{group="read"} 1' in authorized_client.get("/metrics").text
+
+
+def test_shed_cross_origin_request_is_readable(authorized_client, monkeypatch):
+    monkeypatch.setitem(admission.gates, admission.READ,
+                        AdmissionGate(concurrency=0, queue_size=0, timeout=1))
+    response = authorized_client.get("/posts/", headers={"Origin": "https://example.com"})
+    assert response.status_code == 503
+    assert response.headers["Access-Control-Allow-Origin"] in ("*", "https://example.com")
+    assert "retry-after" in response.headers["Access-Control-Expose-Headers"].lower()
@@ -0,0 +1,49 @@
+"""Test module for in-process caches
+"""
+import time
+
+from jose import jwt
+
+from app import models, oauth2
+from app.cache import TTLCache
+from app.config import settings
+from .utils import client, test_user, authorized_client, TestSessionLocal
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_current_user_is_cached_and_invalidated(authorized_client, test_user):
+    authorized_client.get("/posts")
+    authorized_client.get("/posts")
+    stats = authorized_client.get("/stats/cache").json()["auth"]
+    assert stats["users"]["misses"] == 1 and stats["users"]["hits"] == 2
+
+    with TestSessionLocal() as db:
+        user = db.get(models.User, test_user["id"])
+        user.email = "changed@user.com"
+        db.commit()
+    assert oauth2.user_cache.get(test_user["id"]) is None
+
+
+def test_token_without_expiration_is_rejected(client, test_user):
+    token = jwt.encode({"user_id": test_user["id"]}, settings.SECRET_KEY,
+                       algorithm=settings.ALGORITHM)
+    response = client.get("/posts", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+    assert oauth2.token_cache.get(token) is None
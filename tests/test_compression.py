@@ -0,0 +1,65 @@
+"""Test module for response compression
+"""
+import gzip
+
+import brotli
+
+from app import compression
+from app.config import settings
+from .utils import client, test_user, authorized_client
+import pytest
+
+CONTENT = "compressible content " * 500
+
+
+@pytest.fixture
+def posts(authorized_client):
+    compression.compressed_cache.clear()
+    for _ in range(3):
+        authorized_client.post("/posts", json={"title": "title", "content": CONTENT})
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip, deflate, br", "br"), ("gzip", "gzip"), ("br;q=0.5, gzip", "gzip"), ("*", "br"),
+    ("identity", None), ("br;q=0, gzip;q=0", None), ("", None)])
+def test_negotiate(accept_encoding, encoding):
+    assert compression.negotiate(accept_encoding) == encoding
+
+
+@pytest.mark.parametrize("encoding, decompress",
+                         [("gzip", gzip.decompress), ("br", brotli.decompress)])
+def test_compressed_listing_is_cached(authorized_client, posts, encoding, decompress):
+    plain = authorized_client.get("/posts/", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+
+    hits_before = compression.compressed_cache.stats()["hits"]
+    for hits in (0, 1):
+        # raw bytes as sent on the wire
+        headers = {"Accept-Encoding": encoding}
+        with authorized_client.stream("GET", "/posts/", headers=headers) as response:
+            raw = b"".join(response.iter_raw())
+        assert response.headers["Content-Encoding"] == encoding
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert int(response.headers["Content-Length"]) == len(raw) < len(plain.content) // 10
+        assert decompress(raw) == plain.content
+        assert response.headers["ETag"] == f"W/{plain.headers['ETag']}"
+        assert compression.compressed_cache.stats()["hits"] - hits_before == hits
+
+    response = authorized_client.get("/posts/", headers={"Accept-Encoding": encoding,
+                                                         "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_small_responses_are_not_compressed(authorized_client, monkeypatch):
+    monkeypatch.setattr(settings, "COMPRESSION_MIN_SIZE", 10 ** 6)
+    response = authorized_client.get("/posts/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and "Content-Encoding" not in response.headers
+
+
+def test_streamed_export_is_compressed(authorized_client, posts):
+    headers = {"Accept-Encoding": "gzip"}
+    with authorized_client.stream("GET", "/posts/export", headers=headers) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(raw).count(b"\n") == 3
@@ -0,0 +1,221 @@
+"""Test module for likes route
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from sqlalchemy import text
+
+from app import like_buffer as like_buffer_module
+from app.config import settings
+from app.reconcile import reconcile_likes_count
+from app.routers.likes import like_buffer
+from .utils import client, db_mode, test_user, authorized_client, engine, override_session_scope
+import pytest
+
+CONTENT = "content " * 30
+
+
+@pytest.fixture
+def post_id(authorized_client):
+    response = authorized_client.post(
+        "/posts", json={"title": "liked", "content": CONTENT})
+    return response.json()["id"]
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_like_and_dislike_update_likes_count(authorized_client, post_id):
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 409
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+    response = authorized_client.request("DELETE", "/like", json={"post_id": post_id})
+    assert response.status_code == 204
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+
+def test_like_missing_post(authorized_client):
+    assert authorized_client.post("/like", json={"post_id": 1000}).status_code == 404
+
+
+def test_reconcile_likes_count(authorized_client, post_id):
+    authorized_client.post("/like", json={"post_id": post_id})
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE posts SET likes_count = 42"))
+
+    assert reconcile_likes_count(engine, batch_size=1) == 1
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+    assert reconcile_likes_count(engine) == 0
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_like_batch_reports_per_item(authorized_client, post_id):
+    other_id = authorized_client.post(
+        "/posts", json={"title": "other", "content": CONTENT}).json()["id"]
+    authorized_client.post("/like", json={"post_id": other_id})
+
+    response = authorized_client.post("/like/batch", json=[
+        {"post_id": post_id}, {"post_id": other_id}, {"post_id": 1000}, {"post_id": post_id}])
+    assert response.status_code == 201
+    assert [item["status"] for item in response.json()] == [
+        "created", "duplicate", "missing_post", "duplicate"]
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+    assert authorized_client.get(f"/posts/{other_id}").json()["likes"] == 1
+
+
+def test_like_batch_reports_posts_deleted_during_the_insert(authorized_client, post_id):
+    other_id = authorized_client.post(
+        "/posts", json={"title": "other", "content": CONTENT}).json()["id"]
+    responses = []
+    with engine.connect() as deleting:
+        transaction = deleting.begin()
+        deleting.execute(text("DELETE FROM posts WHERE id = :id"), {"id": post_id})
+        batch = threading.Thread(target=lambda: responses.append(authorized_client.post(
+            "/like/batch", json=[{"post_id": post_id}, {"post_id": other_id}])))
+        batch.start()
+        try:
+            # the foreign key check of the batch waits for the deleting transaction
+            with engine.connect() as conn:
+                for _ in range(500):
+                    waiting = text("SELECT count(*) FROM pg_locks WHERE NOT granted")
+                    if conn.execute(waiting).scalar():
+                        break
+                    threading.Event().wait(0.01)
+        finally:
+            transaction.commit()
+            batch.join()
+    assert responses[0].status_code == 201
+    assert [item["status"] for item in responses[0].json()] == ["missing_post", "created"]
+    assert authorized_client.get(f"/posts/{other_id}").json()["likes"] == 1
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    monkeypatch.setattr(settings, "LIKES_WRITE_BEHIND", True)
+    monkeypatch.setattr(like_buffer, "session_scope", override_session_scope)
+    yield like_buffer
+    like_buffer.pending.clear()
+    like_buffer.flushing.clear()
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_write_behind_reads_own_writes(authorized_client, post_id, write_behind):
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 409
+    assert authorized_client.get(f"/like/{post_id}").json() == {"post_id": post_id, "liked": True}
+    # not flushed yet
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+    asyncio.run(write_behind.flush())
+    assert not write_behind.pending
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+    response = authorized_client.request("DELETE", "/like", json={"post_id": post_id})
+    assert response.status_code == 204
+    assert authorized_client.get(f"/like/{post_id}").json()["liked"] is False
+    response = authorized_client.request("DELETE", "/like", json={"post_id": post_id})
+    assert response.status_code == 404
+
+    asyncio.run(write_behind.flush())
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+
+def test_write_behind_deduplicates(authorized_client, post_id, write_behind):
+    for _ in range(3):
+        assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+        response = authorized_client.request("DELETE", "/like", json={"post_id": post_id})
+        assert response.status_code == 204
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    assert len(write_behind.pending) == 1
+    assert authorized_client.post("/like", json={"post_id": 1000}).status_code == 404
+
+    asyncio.run(write_behind.stop())
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+
+def test_write_behind_skips_deleted_posts(authorized_client, post_id, write_behind):
+    authorized_client.post("/like", json={"post_id": post_id})
+    authorized_client.delete(f"/posts/{post_id}")
+
+    asyncio.run(write_behind.flush())
+    assert not write_behind.pending and not write_behind.flushing
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM likes")).scalar() == 0
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_write_behind_reads_own_writes_during_flush(authorized_client, post_id, write_behind,
+                                                    monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+
+    @asynccontextmanager
+    async def held_session_scope():
+        entered.set()
+        await asyncio.to_thread(release.wait, 10)
+        async with override_session_scope() as db:
+            yield db
+
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    monkeypatch.setattr(write_behind, "session_scope", held_session_scope)
+    flush = threading.Thread(target=asyncio.run, args=(write_behind.flush(),))
+    flush.start()
+    try:
+        assert entered.wait(10)
+        # the like is neither pending nor committed
+        assert not write_behind.pending
+        assert authorized_client.get(f"/like/{post_id}").json()["liked"] is True
+        response = authorized_client.request("DELETE", "/like", json={"post_id": post_id})
+        assert response.status_code == 204
+        assert authorized_client.get(f"/like/{post_id}").json()["liked"] is False
+    finally:
+        release.set()
+        flush.join()
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+    asyncio.run(write_behind.flush())
+    assert authorized_client.get(f"/like/{post_id}").json()["liked"] is False
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+
+def test_write_behind_sheds_when_full(authorized_client, post_id, write_behind, monkeypatch):
+    monkeypatch.setattr(write_behind, "max_pending", 1)
+    other_id = authorized_client.post(
+        "/posts", json={"title": "other", "content": CONTENT}).json()["id"]
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    response = authorized_client.post("/like", json={"post_id": other_id})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    # the pending like can still be reverted
+    assert authorized_client.request(
+        "DELETE", "/like", json={"post_id": post_id}).status_code == 204
+    assert authorized_client.post("/like", json={"post_id": other_id}).status_code == 201
+
+
+def test_write_behind_drain_is_retried_at_stop(authorized_client, test_user, post_id, write_behind,
+                                               monkeypatch, caplog):
+    monkeypatch.setattr(like_buffer_module, "STOP_RETRY_SECONDS", 0)
+    failures = []
+
+    @asynccontextmanager
+    async def failing_session_scope(fail: int):
+        if len(failures) < fail:
+            failures.append(True)
+            raise OSError("the DB is down")
+        async with override_session_scope() as db:
+            yield db
+
+    assert authorized_client.post("/like", json={"post_id": post_id}).status_code == 201
+    # recovers on the second attempt
+    monkeypatch.setattr(write_behind, "session_scope", lambda: failing_session_scope(1))
+    asyncio.run(write_behind.stop())
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+    # gives up after the last attempt, the dropped likes are logged
+    assert authorized_client.request(
+        "DELETE", "/like", json={"post_id": post_id}).status_code == 204
+    failures.clear()
+    monkeypatch.setattr(write_behind, "session_scope", lambda: failing_session_scope(100))
+    asyncio.run(write_behind.stop())
+    assert len(failures) == like_buffer_module.STOP_FLUSH_ATTEMPTS
+    assert not write_behind.pending
+    assert "Dropping 1 likes that were not written" in caplog.text
+    assert f"({test_user['id']}, {post_id}): False" in caplog.text
@@ -1,12 +1,74 @@
 """Test module for root route
 """
+import asyncio
+
 from fastapi.testclient import TestClient
-from app.main import app
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import database
+from app.config import settings
+from app.database import get_db
+from app.main import create_app
+from .utils import app, client, engine, override_get_db, ASYNC_DB_URL
 
-client = TestClient(app)
+root_client = TestClient(app)
 
 
 def test_root():
-    response = client.get("/")
+    response = root_client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "FastAPI + SQLAlchemy + PostgresSQL"}
+
+
+def test_create_app_isolates_overrides():
+    from app import main
+    from app.database import get_db
+
+    async def other_db():
+        yield None
+
+    isolated = create_app({get_db: other_db})
+    assert isolated.dependency_overrides == {get_db: other_db}
+    assert get_db not in main.app.dependency_overrides
+    assert app.dependency_overrides[get_db] is not other_db
+
+
+def test_lifespan_warms_up(monkeypatch):
+    test_app = create_app()
+    monkeypatch.setattr(database, "serving_engines", lambda: {"primary": engine})
+    monkeypatch.setattr(settings, "DB_POOL_WARMUP", 2)
+    engine.dispose()
+    with TestClient(test_app):
+        assert test_app.state.startup_seconds > 0
+        assert engine.pool.checkedin() == 2
+
+
+def test_shutdown_of_one_app_leaves_the_others_working(client, monkeypatch):
+    monkeypatch.setattr(settings, "DB_POOL_WARMUP", 0)
+    first, second = create_app({get_db: override_get_db}), create_app({get_db: override_get_db})
+    with TestClient(first) as first_client:
+        with TestClient(second):
+            pass
+        # password hashing threads and pools are still there
+        response = first_client.post(
+            "/users/", json={"email": "first@user.com", "password": "password"})
+        assert response.status_code == 201
+    # the threads are started again for the next app
+    response = client.post("/users/", json={"email": "second@user.com", "password": "password"})
+    assert response.status_code == 201
+
+
+def test_warm_up_pool():
+    async def warm_up(connections, **options):
+        bind = create_async_engine(ASYNC_DB_URL, **options)
+        try:
+            opened = await database.warm_up_pool(bind, connections)
+            return opened, bind.pool.checkedin() if options.get("poolclass") is not NullPool else 0
+        finally:
+            await bind.dispose()
+
+    # capped by the pool size, the connections are back in the pool
+    assert asyncio.run(warm_up(5, pool_size=3)) == (3, 3)
+    # nothing is kept by a NullPool
+    assert asyncio.run(warm_up(5, poolclass=NullPool)) == (0, 0)
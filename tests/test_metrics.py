@@ -0,0 +1,47 @@
+"""Test module for in-process metrics
+"""
+from app.metrics import CONTENT_TYPE, Counter, Histogram, HistogramFamily
+from .utils import client, db_mode, test_user, authorized_client
+import pytest
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram([1, 0.1])
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"0.1": 2, "1": 3, "inf": 4}
+    assert snapshot["count"] == 4 and snapshot["sum"] == 3.65
+
+
+def test_render_text_format():
+    requests = Counter("requests_total", "Requests", ("path",))
+    requests.labels('/a"b').inc(2)
+    latency = HistogramFamily("latency_seconds", "Latency", buckets=(0.5,))
+    latency.labels().observe(0.25)
+
+    assert requests.render() == ["# HELP requests_total Requests", "# TYPE requests_total counter",
+                                 'requests_total{path="/a\\"b"} 2']
+    assert latency.render()[2:] == ['latency_seconds_bucket{le="0.5"} 1',
+                                    'latency_seconds_bucket{le="+Inf"} 1',
+                                    "latency_seconds_sum 0.25", "latency_seconds_count 1"]
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_metrics_route(authorized_client):
+    post_id = authorized_client.post(
+        "/posts", json={"title": "title", "content": "content " * 30}).json()["id"]
+    authorized_client.get(f"/posts/{post_id}")
+    authorized_client.get("/missing")
+    authorized_client.request("PURGE", "/missing")
+
+    response = authorized_client.get("/metrics")
+    assert response.headers["content-type"] == f"{CONTENT_TYPE}; charset=utf-8"
+    text = response.text
+    count = "http_request_duration_seconds_count"
+    assert count + '{method="GET",route="/posts/{post_id}",status="200"}' in text
+    assert count + '{method="GET",route="unmatched",status="404"}' in text
+    assert count + '{method="other",route="unmatched",status="404"}' in text
+    assert 'db_queries_total{route="/posts/{post_id}"}' in text
+    assert 'db_pool_wait_seconds_count{pool="primary"}' in text
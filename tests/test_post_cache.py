@@ -0,0 +1,273 @@
+"""Test module for the post cache
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from app import post_cache as post_cache_module
+from app.config import settings
+from app.database import read_router
+from app.post_cache import post_cache, Entry, MemoryBackend, PostCache, RedisBackend, RedisError
+from app.schemas import PostView
+from .utils import (client, db_mode, test_user, authorized_client, query_count_header, query_count,
+                    DB_URL)
+import pytest
+
+CONTENT = "content " * 30
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(post_cache, "backend", MemoryBackend(100))
+    for counter in ("hits", "stale_hits", "misses"):
+        monkeypatch.setattr(post_cache, counter, 0)
+
+
+class RespServer:
+    """ In-memory stand-in of a Redis server: GET, SET [PX], DEL and SELECT
+    """
+
+    def __init__(self):
+        self.data = {}  # key -> (value, monotonic expiry or None)
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        return "redis://127.0.0.1:%d/1" % self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                count = int((await reader.readline())[1:])
+                args = []
+                for _ in range(count):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.execute(args[0].upper().decode(), args[1:]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError):
+            writer.close()
+
+    def execute(self, command, args) -> bytes:
+        if command == "SELECT":
+            return b"+OK\r\n"
+        if command == "GET":
+            value, expires = self.data.get(args[0], (None, None))
+            if value is None or expires is not None and expires <= time.monotonic():
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == "SET":
+            expires = time.monotonic() + int(args[3]) / 1000 if len(args) == 4 else None
+            self.data[args[0]] = (args[1], expires)
+            return b"+OK\r\n"
+        if command == "DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
+
+
+@pytest.mark.usefixtures("db_mode", "memory_cache", "query_count_header")
+def test_post_reads_are_cached_until_changed(authorized_client):
+    post_id = authorized_client.post(
+        "/posts/", json={"title": "title", "content": CONTENT}).json()["id"]
+    first = authorized_client.get(f"/posts/{post_id}")
+    cached = authorized_client.get(f"/posts/{post_id}")
+    assert cached.json() == first.json() and cached.headers["ETag"] == first.headers["ETag"]
+    assert query_count(cached) == 0
+    response = authorized_client.get(
+        f"/posts/{post_id}", headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 304 and query_count(response) == 0
+
+    authorized_client.put(f"/posts/{post_id}", json={"title": "new title", "content": CONTENT})
+    assert authorized_client.get(f"/posts/{post_id}").json()["Post"]["title"] == "new title"
+    authorized_client.post("/like", json={"post_id": post_id})
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+    authorized_client.delete(f"/posts/{post_id}")
+    assert authorized_client.get(f"/posts/{post_id}").status_code == 404
+    assert post_cache.stats()["hits"] == 2
+
+
+@pytest.mark.usefixtures("memory_cache", "query_count_header")
+def test_first_pages_are_cached_until_changed(authorized_client):
+    authorized_client.post("/posts/", json={"title": "first", "content": CONTENT})
+    for params in ({}, {"cursor": ""}, {"view": "summary"}):
+        authorized_client.get("/posts/", params=params)
+        assert query_count(authorized_client.get("/posts/", params=params)) == 0
+    # later pages and searches are not cached
+    assert query_count(authorized_client.get("/posts/", params={"skip": 1})) == 1
+    assert query_count(authorized_client.get("/posts/", params={"search": "first"})) == 1
+
+    authorized_client.post("/posts/", json={"title": "second", "content": CONTENT})
+    assert len(authorized_client.get("/posts/").json()) == 2
+    assert len(authorized_client.get("/posts/", params={"cursor": ""}).json()["results"]) == 2
+
+
+@pytest.mark.usefixtures("memory_cache", "query_count_header")
+def test_missing_posts_are_cached(authorized_client, monkeypatch):
+    monkeypatch.setattr(post_cache, "negative_ttl", 60)
+    post_id = authorized_client.post(
+        "/posts/", json={"title": "title", "content": CONTENT}).json()["id"]
+    assert authorized_client.get(f"/posts/{post_id + 1}").status_code == 404
+    response = authorized_client.get(f"/posts/{post_id + 1}")
+    assert response.status_code == 404 and query_count(response) == 0
+    # creating the post drops the negative entry of its id
+    assert authorized_client.post(
+        "/posts/", json={"title": "next", "content": CONTENT}).json()["id"] == post_id + 1
+    assert authorized_client.get(f"/posts/{post_id + 1}").status_code == 200
+
+
+class LaggingSession:
+    """ A session on a replica that has not received any post yet
+    """
+
+    def __init__(self):
+        self.info = {}
+
+    async def connection(self):
+        pass
+
+    async def execute(self, *_args, **_kwargs):
+        raise AssertionError("the replica was read")
+
+
+@pytest.mark.usefixtures("memory_cache")
+def test_misses_are_loaded_from_primary(authorized_client, monkeypatch):
+    @asynccontextmanager
+    async def lagging_scope():
+        yield LaggingSession()
+
+    monkeypatch.setattr(settings, "DB_PRIMARY_PIN_SECONDS", 0)
+    monkeypatch.setattr(read_router, "replica_scopes", [lagging_scope])
+    monkeypatch.setattr(read_router, "_down_until", {})
+    post_id = authorized_client.post(
+        "/posts/", json={"title": "title", "content": CONTENT}).json()["id"]
+    assert authorized_client.get(f"/posts/{post_id}").json()["Post"]["title"] == "title"
+    assert authorized_client.get("/posts/").json()[0]["Post"]["id"] == post_id
+
+
+def test_stale_entries_are_served_while_refreshed():
+    loads = []
+
+    async def load(_db):
+        loads.append(len(loads))
+        return Entry(f'"{len(loads)}"', b"{}")
+
+    @asynccontextmanager
+    async def session_scope():
+        yield None
+
+    async def run():
+        cache = PostCache(MemoryBackend(10), 0, 60, 0, session_scope)
+        assert (await cache.post(1, PostView.FULL, None, load)).etag == '"1"'
+        # expired: the old entry is returned at once and refreshed in the background
+        assert (await cache.post(1, PostView.FULL, None, load)).etag == '"1"'
+        await asyncio.gather(*cache._refreshing.values())  # pylint: disable=protected-access
+        assert (await cache.post(1, PostView.FULL, None, load)).etag == '"2"'
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["misses"] == 1 and stats["stale_hits"] == 2
+
+
+def test_redis_backend():
+    async def run():
+        server = RespServer()
+        backend = RedisBackend(await server.start(), timeout=1)
+        await backend.set("key", b"value\r\nwith a line break")
+        assert await backend.get("key") == b"value\r\nwith a line break"
+        await backend.set("short", b"value", ttl=0.01)
+        await backend.delete("key")
+        await asyncio.sleep(0.02)
+        assert await backend.get("key") is None and await backend.get("short") is None
+        with pytest.raises(RedisError):
+            await backend.command("FLUSHALL")
+
+        cache = PostCache(backend, 60, 0, 0, None)
+        loaded = Entry('"etag"', b"[]")
+
+        async def load(_db):
+            return loaded
+
+        assert await cache.listing("full:offset:10", None, load) == loaded
+        assert await cache.listing("full:offset:10", None, None) == loaded
+        await cache.invalidate(1)
+        assert await cache.listing("full:offset:10", None, load) == loaded
+        assert cache.stats()["misses"] == 2
+
+        # an unavailable server reads as a miss
+        await server.stop()
+        await backend.close()
+        assert await cache.post(1, PostView.FULL, None, load) == loaded
+        await backend.close()
+
+    asyncio.run(run())
+
+
+def test_invalidations_reach_other_workers():
+    async def load(_db):
+        return Entry('"etag"', b"{}")
+
+    async def run():
+        sender = PostCache(MemoryBackend(10), 60, 0, 0, None)
+        receiver = PostCache(MemoryBackend(10), 60, 0, 0, None)
+        await sender.listen(DB_URL)
+        await receiver.listen(DB_URL)
+        try:
+            await receiver.post(1, PostView.FULL, None, load)
+            await receiver.post(2, PostView.FULL, None, load)
+            await sender.invalidate(1)
+            for _ in range(100):
+                if await receiver.backend.get("post:1:full") is None:
+                    break
+                await asyncio.sleep(0.02)
+            assert await receiver.backend.get("post:1:full") is None
+            assert await receiver.backend.get("post:2:full") is not None
+        finally:
+            await sender.close()
+            await receiver.close()
+
+    asyncio.run(run())
+
+
+def test_lost_invalidations_connection_is_reopened(monkeypatch):
+    monkeypatch.setattr(post_cache_module, "RECONNECT_SECONDS", 0.01)
+
+    async def load(_db):
+        return Entry('"etag"', b"{}")
+
+    async def run():
+        sender = PostCache(MemoryBackend(10), 60, 0, 0, None)
+        receiver = PostCache(MemoryBackend(10), 60, 0, 0, None)
+        await sender.listen(DB_URL)
+        await receiver.listen(DB_URL)
+        try:
+            await receiver.post(1, PostView.FULL, None, load)
+            lost = receiver.notifier._connection  # pylint: disable=protected-access
+            admin = await asyncpg.connect(DB_URL)
+            await admin.execute("SELECT pg_terminate_backend($1)", lost.get_server_pid())
+            await admin.close()
+            for _ in range(100):
+                connection = receiver.notifier._connection  # pylint: disable=protected-access
+                if connection not in (None, lost):
+                    break
+                await asyncio.sleep(0.02)
+            # the entries may be older than the invalidations missed in between
+            assert await receiver.backend.get("post:1:full") is None
+
+            await receiver.post(2, PostView.FULL, None, load)
+            await sender.invalidate(2)
+            for _ in range(100):
+                if await receiver.backend.get("post:2:full") is None:
+                    break
+                await asyncio.sleep(0.02)
+            assert await receiver.backend.get("post:2:full") is None
+        finally:
+            await sender.close()
+            await receiver.close()
+
+    asyncio.run(run())
@@ -0,0 +1,186 @@
+"""Test module for posts route
+"""
+import json
+
+from app import schemas
+from .utils import client, db_mode, test_user, authorized_client, query_count_header, query_count
+import pytest
+
+CONTENT = "content " * 30
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_post_lifecycle(authorized_client, test_user):
+    response = authorized_client.post(
+        "/posts", json={"title": "first", "content": CONTENT})
+    assert response.status_code == 201
+    post = response.json()
+    assert post["user"]["email"] == test_user["email"]
+
+    response = authorized_client.get(f"/posts/{post['id']}")
+    assert response.status_code == 200
+    assert response.json()["likes"] == 0
+
+    response = authorized_client.put(
+        f"/posts/{post['id']}", json={"title": "updated", "content": CONTENT})
+    assert response.status_code == 200
+    assert response.json()["title"] == "updated"
+
+    response = authorized_client.get("/posts", params={"search": "upd"})
+    assert [p["Post"]["id"] for p in response.json()] == [post["id"]]
+    # the fast listing path keeps the documented response shape
+    listed = schemas.PostResponseWithLikes(**response.json()[0])
+    assert listed.Post.user.email == test_user["email"]
+
+    assert authorized_client.delete(f"/posts/{post['id']}").status_code == 204
+    assert authorized_client.get(f"/posts/{post['id']}").status_code == 404
+
+
+def test_get_posts_unauthorized(client):
+    assert client.get("/posts").status_code == 401
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_get_posts_cursor_pagination(authorized_client):
+    ids = [authorized_client.post(
+        "/posts", json={"title": f"post {i}", "content": CONTENT}).json()["id"] for i in range(5)]
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        page = authorized_client.get("/posts", params={"cursor": cursor, "limit": 2}).json()
+        assert len(page["results"]) <= 2
+        seen += [p["Post"]["id"] for p in page["results"]]
+        cursor = page["next_cursor"]
+    assert seen == ids[::-1]
+
+
+def test_get_posts_pagination_validation(authorized_client):
+    assert authorized_client.get("/posts", params={"limit": 1000}).status_code == 422
+    assert authorized_client.get("/posts", params={"cursor": "garbage"}).status_code == 400
+
+
+def test_search_posts_full_text(authorized_client):
+    authorized_client.post("/posts", json={"title": "cooking pasta", "content": CONTENT})
+    authorized_client.post("/posts", json={"title": "gardening", "content": CONTENT + " pasta"})
+    authorized_client.post("/posts", json={"title": "unrelated", "content": CONTENT})
+
+    response = authorized_client.get("/posts/search", params={"q": "pasta"})
+    assert response.status_code == 200
+    # title matches rank higher than content matches
+    assert [p["Post"]["title"] for p in response.json()] == ["cooking pasta", "gardening"]
+
+
+def test_get_post_conditional(authorized_client):
+    post_id = authorized_client.post(
+        "/posts", json={"title": "etag", "content": CONTENT}).json()["id"]
+    response = authorized_client.get(f"/posts/{post_id}")
+    etag = response.headers["ETag"]
+
+    response = authorized_client.get(f"/posts/{post_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag and not response.content
+
+    authorized_client.post("/like", json={"post_id": post_id})
+    response = authorized_client.get(f"/posts/{post_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    authorized_client.put(f"/posts/{post_id}", json={"title": "changed", "content": CONTENT})
+    response = authorized_client.get(f"/posts/{post_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json()["Post"]["title"] == "changed"
+
+    etag = authorized_client.get("/posts").headers["ETag"]
+    assert authorized_client.get("/posts", headers={"If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_summary_view(authorized_client):
+    content = "long content " * 800
+    post_id = authorized_client.post(
+        "/posts", json={"title": "summary", "content": content}).json()["id"]
+
+    full = authorized_client.get("/posts", params={"limit": 1}).content
+    response = authorized_client.get("/posts", params={"limit": 1, "view": "summary"})
+    summary = schemas.PostSummaryWithLikes(**response.json()[0])
+    assert summary.Post.excerpt == content[:schemas.EXCERPT_LENGTH]
+    assert "content" not in response.json()[0]["Post"]
+    assert len(response.content) * 10 < len(full)
+
+    page = authorized_client.get("/posts", params={"cursor": "", "view": "summary"}).json()
+    assert page["results"][0]["Post"]["excerpt"] == summary.Post.excerpt
+
+    response = authorized_client.get(f"/posts/{post_id}", params={"view": "summary"})
+    assert schemas.PostSummaryWithLikes(**response.json()) == summary
+    # each view has its own version
+    full_etag = authorized_client.get(f"/posts/{post_id}").headers["ETag"]
+    assert response.headers["ETag"] != full_etag
+    response = authorized_client.get(f"/posts/{post_id}", params={"view": "summary"},
+                                     headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+@pytest.mark.usefixtures("db_mode", "query_count_header")
+def test_posts_query_count_is_bounded(client):
+    for i in range(5):
+        client.post("/users", json={"email": f"author{i}@user.com", "password": "password"})
+        token = client.post(
+            "/login", data={"username": f"author{i}@user.com", "password": "password"})
+        headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+        post_id = client.post("/posts", json={"title": f"post {i}", "content": CONTENT},
+                              headers=headers).json()["id"]
+
+    # the current user is cached after the first request, authors come with the posts
+    assert query_count(client.get("/posts", headers=headers)) <= 1
+    assert query_count(client.get("/posts", params={"cursor": ""}, headers=headers)) <= 1
+    assert query_count(client.get(f"/posts/{post_id}", headers=headers)) <= 1
+    assert query_count(client.put(f"/posts/{post_id}", json={"title": "new", "content": CONTENT},
+                                  headers=headers)) <= 3
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_create_posts_batch(authorized_client, test_user):
+    response = authorized_client.post("/posts/batch", json=[
+        {"title": f"batch {i}", "content": CONTENT} for i in range(3)])
+    assert response.status_code == 201
+    created = response.json()
+    assert [item["status"] for item in created] == ["created"] * 3
+    for i, item in enumerate(created):
+        post = authorized_client.get(f"/posts/{item['id']}").json()["Post"]
+        assert post["title"] == f"batch {i}" and post["user_id"] == test_user["id"]
+
+
+def test_create_posts_batch_validation(authorized_client):
+    assert authorized_client.post("/posts/batch", json=[]).status_code == 422
+    assert authorized_client.post(
+        "/posts/batch", json=[{"title": "x", "content": CONTENT}]).status_code == 422
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_export_posts_streams_ndjson(authorized_client):
+    authorized_client.post(
+        "/posts/batch", json=[{"title": f"export {i}", "content": CONTENT} for i in range(3)])
+    response = authorized_client.get("/posts/export")
+    assert [json.loads(line)["title"] for line in response.text.splitlines()] == [
+        f"export {i}" for i in range(3)]
+
+
+@pytest.mark.usefixtures("db_mode", "query_count_header")
+def test_post_writes_of_other_users(authorized_client):
+    post_id = authorized_client.post(
+        "/posts", json={"title": "mine", "content": CONTENT}).json()["id"]
+    authorized_client.post("/users", json={"email": "other@user.com", "password": "password"})
+    token = authorized_client.post(
+        "/login", data={"username": "other@user.com", "password": "password"})
+    headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+    authorized_client.get("/posts", headers=headers)  # caches the other user
+
+    response = authorized_client.put(
+        f"/posts/{post_id}", json={"title": "theirs", "content": CONTENT}, headers=headers)
+    assert response.status_code == 403
+    assert authorized_client.delete(f"/posts/{post_id}", headers=headers).status_code == 403
+    assert authorized_client.delete("/posts/1000", headers=headers).status_code == 404
+    # the owner path is a single statement
+    response = authorized_client.put(
+        f"/posts/{post_id}", json={"title": "still mine", "content": CONTENT})
+    assert response.status_code == 200 and query_count(response) == 1
+    assert query_count(authorized_client.delete(f"/posts/{post_id}")) == 1
@@ -0,0 +1,42 @@
+"""Test module for on-demand request profiling
+"""
+from app.config import settings
+from .utils import client, db_mode, test_user, authorized_client
+import pytest
+
+TOKEN = "secret-profiling-token"
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(settings, "PROFILING_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_profiled_request_report(authorized_client, profiling):
+    authorized_client.post("/posts", json={"title": "title", "content": "content " * 30})
+
+    response = authorized_client.get("/posts/", headers={"X-Profile": TOKEN})
+    assert response.status_code == 200 and len(response.json()) == 1
+    report_id = response.headers["X-Profile-Id"]
+    report = (profiling / f"{report_id}.txt").read_text()
+    assert report.startswith("GET /posts/ -> 200")
+    assert "including other concurrent requests" in report.splitlines()[1]
+    assert "FROM posts JOIN users" in report
+    assert "get_posts" in report
+    assert (profiling / f"{report_id}.prof").exists()
+
+
+def test_profiling_requires_token(authorized_client, profiling):
+    response = authorized_client.get("/posts", headers={"X-Profile": "guess"})
+    assert response.status_code == 200 and "X-Profile-Id" not in response.headers
+    assert not list(profiling.iterdir())
+
+
+def test_profiling_disabled(authorized_client, profiling, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", False)
+    response = authorized_client.get("/posts", headers={"X-Profile": TOKEN})
+    assert "X-Profile-Id" not in response.headers
@@ -0,0 +1,150 @@
+"""Query plan regression tests: the statements of the hot routes must be index-backed
+
+Every statement a route executes is EXPLAINed against seeded data with sequential
+scans disabled, so a plan still containing one means no index can serve it. Index
+conditions must constrain the leading column of the index, otherwise the whole index
+is read. Sorts are allowed only where the order can not come from an index (search ranking).
+The pg_trgm backed title filter is not covered: the test DB is created without the extension
+"""
+import re
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+
+from app import oauth2
+from app.config import settings
+from app.utils import encode_cursor
+from benchmarks.seed import seed, EMAIL, PASSWORD
+from .utils import app, engine, Base
+import pytest
+
+SORT_NODES = ("Sort", "Incremental Sort")
+INDEX_SCAN_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+LEADING_COLUMNS = text(
+    "SELECT index.relname, attribute.attname FROM pg_index "
+    "JOIN pg_class AS index ON index.oid = pg_index.indexrelid "
+    "JOIN pg_attribute AS attribute ON attribute.attrelid = pg_index.indrelid "
+    "AND attribute.attnum = pg_index.indkey[0]")
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    oauth2.user_cache.clear()
+    oauth2.token_cache.clear()
+    seed(users=100, posts=2000, likes=5000, skew=1.1, seed_value=0, bind=engine)
+    with engine.begin() as conn:
+        deep = conn.execute(text("SELECT created, id FROM posts ORDER BY created DESC, id DESC "
+                                 "OFFSET 1000 LIMIT 1")).one()
+    return {"deep_cursor": encode_cursor(deep.created, deep.id)}
+
+
+@pytest.fixture
+def plan_client(seeded, monkeypatch):
+    """ Client of a seeded user in the sync mode, its statements can be replayed by psycopg2
+    """
+    monkeypatch.setattr(settings, "DB_ASYNC", False)
+    client = TestClient(app)
+    token = client.post("/login", data={"username": EMAIL.format(1), "password": PASSWORD}).json()
+    client.headers = {**client.headers, "Authorization": f"Bearer {token['access_token']}"}
+    return client
+
+
+@contextmanager
+def captured_statements():
+    """ Collects (statement, parameters) executed by the test engine
+    """
+    statements = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _executemany):
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def assert_index_backed(statement: str, parameters, allow_sort: bool = False):
+    with engine.connect() as conn:
+        leading_columns = dict(conn.execute(LEADING_COLUMNS).all())
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0][0]["Plan"]
+    finally:
+        connection.rollback()
+        connection.close()
+    for node in plan_nodes(plan):
+        assert node["Node Type"] != "Seq Scan", \
+            f"Seq Scan on {node.get('Relation Name')}: {statement}"
+        if node["Node Type"] in INDEX_SCAN_NODES and "Index Cond" in node:
+            column = leading_columns[node["Index Name"]]
+            assert re.search(rf"\b{column}\b", node["Index Cond"]), \
+                f"{node['Index Name']} read without a condition on {column}: {statement}"
+        if not allow_sort:
+            assert node["Node Type"] not in SORT_NODES, \
+                f"{node['Node Type']} by {node.get('Sort Key')}: {statement}"
+
+
+def assert_route_index_backed(client, method: str, url: str, allow_sort: bool = False, **kwargs):
+    with captured_statements() as statements:
+        response = client.request(method, url, **kwargs)
+    assert response.status_code < 400, response.text
+    assert statements
+    for statement, parameters in statements:
+        assert_index_backed(statement, parameters, allow_sort)
+
+
+@pytest.mark.parametrize("url", ["/posts/?limit=10&skip=1000", "/posts/?cursor=", "/posts/42",
+                                 "/users/?skip=50", "/users/7"])
+def test_reads_are_index_backed(plan_client, url):
+    assert_route_index_backed(plan_client, "GET", url)
+
+
+def test_deep_cursor_page_is_index_backed(plan_client, seeded):
+    assert_route_index_backed(plan_client, "GET", f"/posts/?cursor={seeded['deep_cursor']}")
+
+
+def test_search_sorts_by_rank_only(plan_client):
+    assert_route_index_backed(plan_client, "GET", "/posts/search?q=postgres", allow_sort=True)
+
+
+def test_login_is_index_backed(plan_client):
+    assert_route_index_backed(plan_client, "POST", "/login",
+                              data={"username": EMAIL.format(2), "password": PASSWORD})
+
+
+def test_like_and_dislike_are_index_backed(plan_client):
+    like = {"post_id": 1999}
+    plan_client.request("DELETE", "/like", json=like)
+    assert_route_index_backed(plan_client, "POST", "/like", json=like)
+    assert_route_index_backed(plan_client, "DELETE", "/like", json=like)
+
+
+def test_post_writes_are_index_backed(plan_client):
+    post = {"title": "title", "content": "content " * 30}
+    post_id = plan_client.post("/posts", json=post).json()["id"]
+    assert_route_index_backed(plan_client, "PUT", f"/posts/{post_id}", json=post)
+    assert_route_index_backed(plan_client, "DELETE", f"/posts/{post_id}")
+
+
+@pytest.mark.parametrize("statement", ["DELETE FROM likes WHERE post_id = %(id)s",
+                                       "DELETE FROM posts WHERE user_id = %(id)s"])
+def test_cascades_are_index_backed(seeded, statement):
+    # what ON DELETE CASCADE runs when a post / a user is deleted
+    assert_index_backed(statement, {"id": 1})
@@ -1,6 +1,9 @@
 """Test module for users route
 """
-from .utils import client
+import json
+
+from .utils import client, db_mode, test_user, authorized_client
+from app.config import settings
 from app.schemas import UserResponse
 import pytest
 
@@ -13,3 +16,37 @@ def test_create_user(client):
     new_user = UserResponse(**response.json())
     assert new_user.email == email
     assert response.status_code == 201
+
+
+def test_get_user_conditional(authorized_client, test_user):
+    response = authorized_client.get(f"/users/{test_user['id']}")
+    etag = response.headers["ETag"]
+    response = authorized_client.get(f"/users/{test_user['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+@pytest.mark.usefixtures("db_mode")
+def test_export_users_streams_ndjson(authorized_client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 2)
+    for i in range(4):
+        authorized_client.post(
+            "/users", json={"email": f"export{i}@user.com", "password": "password"})
+
+    response = authorized_client.get("/users/export")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["email"] for line in lines] == [test_user["email"]] + [
+        f"export{i}@user.com" for i in range(4)]
+    assert "password" not in lines[0]
+
+
+def test_get_users_is_paginated(authorized_client):
+    authorized_client.post("/users", json={"email": "second@user.com", "password": "password"})
+    assert len(authorized_client.get("/users", params={"limit": 1}).json()) == 1
+    assert authorized_client.get("/users", params={"limit": 1000}).status_code == 422
+
+
+def test_create_user_duplicate_email(client):
+    client.post("/users", json={"email": "dup@user.com", "password": "password"})
+    response = client.post("/users", json={"email": "dup@user.com", "password": "password"})
+    assert response.status_code == 409
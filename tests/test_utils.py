@@ -0,0 +1,68 @@
+"""Test module for utilities
+"""
+import asyncio
+import threading
+
+from passlib.hash import bcrypt
+import pytest
+
+from app import models, utils
+from .utils import client, TestSessionLocal
+
+
+def test_bounded_executor_rejects_overflow():
+    executor = utils.BoundedExecutor(workers=1, max_queued=1)
+    release = threading.Event()
+
+    async def scenario():
+        jobs = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(utils.ExecutorOverloaded):
+            await executor.run(release.wait)
+        release.set()
+        return await asyncio.gather(*jobs)
+
+    assert asyncio.run(scenario()) == [True, True]
+    asyncio.run(executor.shutdown())
+
+
+def test_bounded_executor_counts_jobs_of_cancelled_callers():
+    executor = utils.BoundedExecutor(workers=1, max_queued=0)
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        return release.wait(10)
+
+    async def scenario():
+        caller = asyncio.create_task(executor.run(job))
+        await asyncio.to_thread(started.wait, 10)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        # the thread is still busy
+        assert executor.pending == 1
+        with pytest.raises(utils.ExecutorOverloaded):
+            await executor.run(job)
+        release.set()
+        await executor.shutdown()
+        await asyncio.sleep(0)
+        assert executor.pending == 0
+        assert await executor.run(lambda: True)
+
+    asyncio.run(scenario())
+    asyncio.run(executor.shutdown())
+
+
+def test_login_rehashes_password_with_outdated_cost(client):
+    with TestSessionLocal() as db:
+        db.add(models.User(email="old@user.com", password=bcrypt.using(rounds=4).hash("password")))
+        db.commit()
+
+    response = client.post("/login", data={"username": "old@user.com", "password": "password"})
+    assert response.status_code == 201
+
+    with TestSessionLocal() as db:
+        stored = db.query(models.User).filter(models.User.email == "old@user.com").one().password
+    assert not utils.PWD_CONTEXT.needs_update(stored)
+    assert utils.verify_pwd("password", stored)